@@ -0,0 +1,242 @@
+from app.database import pool_manager, DatabaseBusyError
+from datetime import datetime
+import asyncio
+import asyncpg
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_COLUMNS = ("occurred_at", "event", "actor_email", "company_id", "ip", "details")
+
+# Failures worth retrying: no connection, pool exhausted, server shutting down
+# or out of resources. Any other database error (e.g. a missing table) would
+# fail the same way forever, so the batch is dropped instead.
+TRANSIENT_ERRORS = (
+    DatabaseBusyError, OSError, asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError, asyncpg.OperatorInterventionError, asyncpg.InsufficientResourcesError,
+)
+
+# Attached monthly partitions named activity_YYYY_MM, with their lower bound
+PARTITIONS_QUERY = """
+SELECT c.relname AS name
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+WHERE p.relname = 'activity' AND c.relname ~ '^activity_[0-9]{4}_[0-9]{2}$'
+"""
+
+# Rows the DEFAULT partition holds for a month that has no partition yet
+DEFAULT_HAS_ROWS_QUERY = """
+SELECT EXISTS (SELECT 1 FROM activity_default WHERE occurred_at >= $1 AND occurred_at < $2)
+"""
+
+# Runs while activity_default is detached, so the rows route to the new month
+MOVE_FROM_DEFAULT_QUERY = f"""
+WITH moved AS (
+    DELETE FROM activity_default WHERE occurred_at >= $1 AND occurred_at < $2
+    RETURNING {", ".join(ACTIVITY_COLUMNS)}
+)
+INSERT INTO activity ({", ".join(ACTIVITY_COLUMNS)})
+SELECT {", ".join(ACTIVITY_COLUMNS)} FROM moved
+"""
+
+
+class ActivityLog:
+    # Handlers enqueue events without a database round trip; one background
+    # task writes them with COPY in batches of batch_size, or flush_seconds
+    # after the first event of a batch, whichever comes first. The queue is
+    # bounded: when it is full record() waits up to enqueue_timeout
+    # (backpressure) and then drops the event. A write that fails transiently
+    # is retried until it succeeds, so a database outage fills the queue
+    # rather than losing batches; a batch that fails permanently is dropped so
+    # it cannot wedge the queue. stop() drains the queue before returning.
+    def __init__(self, max_queue, batch_size, flush_seconds, enqueue_timeout, shutdown_timeout, pool="background"):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.enqueue_timeout = enqueue_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.pool = pool
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self._closing = False
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.write_failures = 0
+        self.last_flush_ms = None
+        self._last_drop_warning = 0.0
+
+    async def record(self, event, actor_email=None, company_id=None, ip=None, **details):
+        if self._closing:
+            self.dropped += 1
+            return
+        item = (
+            datetime.utcnow(), event, actor_email, company_id, ip,
+            json.dumps(details, default=str) if details else None,
+        )
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.backpressure_waits += 1
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                # At most one warning every 10 seconds, so an overload does not also flood the logs
+                now = time.monotonic()
+                if now - self._last_drop_warning >= 10:
+                    self._last_drop_warning = now
+                    logger.warning(f"Activity queue full, dropping events ({self.dropped} dropped so far)")
+
+    async def _write(self, batch):
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                async with pool_manager.acquire(self.pool) as conn:
+                    await conn.copy_records_to_table("activity", records=batch, columns=ACTIVITY_COLUMNS)
+            except TRANSIENT_ERRORS as e:
+                self.write_failures += 1
+                attempt += 1
+                if self._closing and attempt >= 3:
+                    self.dropped += len(batch)
+                    logger.error(f"Dropped {len(batch)} activity events at shutdown: {str(e)}")
+                    return
+                logger.warning(f"Activity write failed (attempt {attempt}): {str(e)}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                self.write_failures += 1
+                self.dropped += len(batch)
+                logger.error(f"Dropped {len(batch)} activity events: {type(e).__name__}: {str(e)}")
+                return
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            self.written += len(batch)
+            self.batches += 1
+            return
+
+    async def _collect(self):
+        # Waits for one event, then gathers more until the batch is full or the
+        # flush interval has passed since that first event
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if self._closing or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # None is the wake-up that stop() enqueues
+        return [item for item in batch if item is not None]
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._write(batch)
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._closing = True
+        try:
+            # Wakes the flusher if it is waiting on an empty queue
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._task, self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += self._queue.qsize()
+            logger.error(f"Activity log did not drain within {self.shutdown_timeout}s")
+        self._task = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "backpressure_waits": self.backpressure_waits,
+            "write_failures": self.write_failures,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+def _month_start(year, month):
+    # Normalises month overflow/underflow, e.g. (2025, 13) -> 2026-01-01
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+async def _create_partition(conn, name, start, end):
+    # Postgres refuses to add a month the DEFAULT partition already has rows
+    # for, so those rows are moved in the same transaction: detach the
+    # default, create the month, move its rows across, re-attach the default.
+    # Writers block on the parent table's lock until it commits.
+    async with conn.transaction():
+        stranded = await conn.fetchval(DEFAULT_HAS_ROWS_QUERY, start, end)
+        if stranded:
+            await conn.execute("ALTER TABLE activity DETACH PARTITION activity_default")
+        await conn.execute(
+            f"CREATE TABLE {name} PARTITION OF activity "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+        if stranded:
+            moved = await conn.execute(MOVE_FROM_DEFAULT_QUERY, start, end)
+            await conn.execute("ALTER TABLE activity ATTACH PARTITION activity_default DEFAULT")
+            logger.info(f"Moved {moved.split()[-1]} activity rows from activity_default to {name}")
+
+
+async def maintain_activity_partitions(months_ahead=1, retention_months=0):
+    # Scheduler job: creates this month's and the next months_ahead partitions,
+    # and drops whole months older than retention_months (0 keeps them all).
+    # A month that fails is logged and reported under "failed"; the others
+    # are still processed.
+    now = datetime.utcnow()
+    created, dropped, failed = 0, 0, []
+    async with pool_manager.acquire("background") as conn:
+        existing = {row["name"] for row in await conn.fetch(PARTITIONS_QUERY)}
+        for offset in range(months_ahead + 1):
+            start = _month_start(now.year, now.month + offset)
+            end = _month_start(start.year, start.month + 1)
+            name = f"activity_{start:%Y_%m}"
+            if name in existing:
+                continue
+            try:
+                await _create_partition(conn, name, start, end)
+            except asyncpg.PostgresError as e:
+                failed.append(name)
+                logger.error(f"Failed to create activity partition {name}: {str(e)}")
+                continue
+            created += 1
+            logger.info(f"Created activity partition {name}")
+        if retention_months > 0:
+            oldest_kept = f"activity_{_month_start(now.year, now.month - retention_months):%Y_%m}"
+            for name in sorted(existing):
+                # Names sort chronologically
+                if name >= oldest_kept:
+                    continue
+                try:
+                    await conn.execute(f"DROP TABLE IF EXISTS {name}")
+                except asyncpg.PostgresError as e:
+                    failed.append(name)
+                    logger.error(f"Failed to drop activity partition {name}: {str(e)}")
+                    continue
+                dropped += 1
+                logger.info(f"Dropped activity partition {name}")
+    return {"created": created, "dropped": dropped, "failed": failed}
@@ -0,0 +1,80 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Records one failed attempt for each (failure counter, lock) key pair and
+# locks a key out once its counter reaches that pair's threshold. The lockout
+# doubles with every further failure, capped at max_ms.
+# KEYS: fail_1, lock_1, fail_2, lock_2, ...
+# ARGV: window_ms, base_ms, max_ms, threshold_1, threshold_2, ...
+RECORD_FAILURE_SCRIPT = """
+local window_ms = tonumber(ARGV[1])
+local base_ms = tonumber(ARGV[2])
+local max_ms = tonumber(ARGV[3])
+local longest = 0
+for i = 1, #KEYS, 2 do
+    local threshold = tonumber(ARGV[3 + (i + 1) / 2])
+    local failures = redis.call('INCR', KEYS[i])
+    redis.call('PEXPIRE', KEYS[i], window_ms)
+    if failures >= threshold then
+        local lock_ms = math.min(base_ms * 2 ^ (failures - threshold), max_ms)
+        redis.call('SET', KEYS[i + 1], failures, 'PX', math.floor(lock_ms))
+        longest = math.max(longest, lock_ms)
+    end
+end
+return math.floor(longest)
+"""
+
+
+class TooManyAttemptsError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many attempts, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AttemptGate:
+    def __init__(self, redis_client, scope, account_limit, ip_limit, window_seconds, base_lockout_seconds, max_lockout_seconds):
+        self.redis = redis_client
+        self.scope = scope
+        self.account_limit = account_limit
+        self.ip_limit = ip_limit
+        # Counters must outlive the longest lockout or the backoff would reset
+        self.window_ms = int(max(window_seconds, max_lockout_seconds) * 1000)
+        self.base_ms = int(base_lockout_seconds * 1000)
+        self.max_ms = int(max_lockout_seconds * 1000)
+        self._record_failure = redis_client.register_script(RECORD_FAILURE_SCRIPT)
+
+    def _keys(self, kind, value):
+        return f"attempts:fail:{self.scope}:{kind}:{value}", f"attempts:lock:{self.scope}:{kind}:{value}"
+
+    def _pairs(self, account, ip):
+        pairs = [(self._keys("account", account.lower()), self.account_limit)]
+        if ip:
+            pairs.append((self._keys("ip", ip), self.ip_limit))
+        return pairs
+
+    async def check(self, account, ip):
+        # One pipelined round trip; raises before any database or bcrypt work
+        pipe = self.redis.pipeline(transaction=False)
+        for (_, lock_key), _ in self._pairs(account, ip):
+            pipe.pttl(lock_key)
+        remaining_ms = max(await pipe.execute())
+        if remaining_ms > 0:
+            logger.warning(f"{self.scope} attempt blocked for {account} from {ip}")
+            raise TooManyAttemptsError(math.ceil(remaining_ms / 1000))
+
+    async def record_failure(self, account, ip):
+        keys, args = [], [self.window_ms, self.base_ms, self.max_ms]
+        for (fail_key, lock_key), limit in self._pairs(account, ip):
+            keys += [fail_key, lock_key]
+            args.append(limit)
+        lock_ms = await self._record_failure(keys=keys, args=args)
+        if lock_ms:
+            logger.warning(f"{self.scope} locked out for {account} from {ip} ({lock_ms} ms)")
+        return lock_ms
+
+    async def reset(self, account):
+        # A successful attempt clears the account counter; the IP counter keeps decaying
+        fail_key, lock_key = self._keys("account", account.lower())
+        await self.redis.delete(fail_key, lock_key)
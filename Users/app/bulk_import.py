@@ -0,0 +1,480 @@
+from app.config import IMPORT_BATCH_SIZE, IMPORT_MAX_REPORTED_ERRORS, IMPORT_MAX_RECORD_SIZE
+from app.database import pool_manager
+from app.schemas import UserBusiness, UserCreate
+from pydantic import ValidationError
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson")
+_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+# Staging tables live for one batch transaction (ON COMMIT DROP), so pooled
+# connections are never left holding import state. Statements that reference
+# them are kept here rather than in app.queries, whose statements are prepared
+# on every new connection.
+BUSINESS_STAGING = (
+    "CREATE TEMP TABLE import_business ("
+    "line INTEGER, company_name VARCHAR(255), email VARCHAR(255), phone VARCHAR(20), "
+    "hq VARCHAR(50), operations VARCHAR(225), website VARCHAR(50), details VARCHAR(225)"
+    ") ON COMMIT DROP"
+)
+# Inserts the first row per email and returns every staged row that was not
+# inserted (already registered, or repeated in the file)
+BUSINESS_MERGE = """
+WITH candidates AS (
+    SELECT *, row_number() OVER (PARTITION BY email ORDER BY line) AS rn FROM import_business
+), merged AS (
+    INSERT INTO Business (company_name, email, phone, hq, operations, website, details)
+    SELECT company_name, email, phone, hq, operations, website, details
+    FROM candidates WHERE rn = 1 ORDER BY line
+    ON CONFLICT (email) DO NOTHING
+    RETURNING email
+)
+SELECT line, email, 'Email already exists' AS reason FROM candidates
+WHERE rn > 1 OR email NOT IN (SELECT email FROM merged)
+ORDER BY line
+"""
+
+USERS_STAGING = (
+    "CREATE TEMP TABLE import_users ("
+    "line INTEGER, name VARCHAR(255), email VARCHAR(255), phone VARCHAR(20), "
+    "password VARCHAR(255), role VARCHAR(50), company_id INTEGER"
+    ") ON COMMIT DROP"
+)
+# Rows pointing at a missing company are filtered out up front, so one bad
+# company_id rejects that row instead of failing the batch on the FK
+USERS_MERGE = """
+WITH checked AS (
+    SELECT s.*, EXISTS (SELECT 1 FROM Business b WHERE b.id = s.company_id) AS company_ok
+    FROM import_users s
+), candidates AS (
+    SELECT *, row_number() OVER (PARTITION BY email, company_ok ORDER BY line) AS rn FROM checked
+), merged AS (
+    INSERT INTO users (name, email, phone, password, role, company_id)
+    SELECT name, email, phone, password, role, company_id
+    FROM candidates WHERE company_ok AND rn = 1 ORDER BY line
+    ON CONFLICT (email) DO NOTHING
+    RETURNING email
+)
+SELECT line, email,
+       CASE WHEN company_ok THEN 'Email already exists' ELSE 'Invalid company ID' END AS reason
+FROM candidates
+WHERE NOT company_ok OR rn > 1 OR email NOT IN (SELECT email FROM merged)
+ORDER BY line
+"""
+
+
+class ImportFormatError(Exception):
+    # The stream itself is unreadable (encoding, header, unterminated quote); row
+    # level problems are reported per line instead
+    pass
+
+
+class ImportKind:
+    def __init__(self, schema, staging_table, staging_sql, merge_sql, columns, to_record, hashes_password=False,
+                 company_field=None):
+        self.schema = schema
+        self.staging_table = staging_table
+        self.staging_sql = staging_sql
+        self.merge_sql = merge_sql
+        # Staging column order, after "line"
+        self.columns = columns
+        self.to_record = to_record
+        self.hashes_password = hashes_password
+        # Field naming the owning company, for imports scoped to one company
+        self.company_field = company_field
+
+
+IMPORT_KINDS = {
+    "business": ImportKind(
+        UserBusiness, "import_business", BUSINESS_STAGING, BUSINESS_MERGE,
+        ("company_name", "email", "phone", "hq", "operations", "website", "details"),
+        lambda row, _: (row.name, row.email, row.phone, row.hq, row.operations, row.website, row.details),
+    ),
+    "users": ImportKind(
+        UserCreate, "import_users", USERS_STAGING, USERS_MERGE,
+        ("name", "email", "phone", "password", "role", "company_id"),
+        lambda row, hashed: (row.name, row.email, row.phone, hashed, row.role, row.company_id),
+        hashes_password=True,
+        company_field="company_id",
+    ),
+}
+
+
+def import_format(content_type):
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return _CONTENT_TYPES.get(media_type)
+
+
+class ImportReport:
+    # Running totals for one import; exposed while in progress and returned at the end
+    def __init__(self, kind, fmt, owner=None, max_errors=IMPORT_MAX_REPORTED_ERRORS):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.format = fmt
+        self.owner = owner
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.invalid = 0
+        self.conflicts = 0
+        self.batches = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    def reject(self, line, reason, email=None):
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "email": email, "reason": reason})
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        rejected = self.invalid + self.conflicts
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "format": self.format,
+            "done": self.finished is not None,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "invalid": self.invalid,
+            "conflicts": self.conflicts,
+            "batches": self.batches,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+            "errors": self.errors,
+            "errors_truncated": rejected > len(self.errors),
+        }
+
+
+# Imports currently running in this worker, by report id
+imports_in_progress = {}
+
+
+async def _line_batches(chunks, max_line=IMPORT_MAX_RECORD_SIZE):
+    # Decodes a byte stream incrementally and yields the complete lines of each
+    # chunk as a list; only the current partial line is buffered
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    number = 0
+    try:
+        async for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            number += len(lines)
+            if len(pending) > max_line:
+                raise ImportFormatError(f"Line {number + 1} is longer than {max_line} characters")
+            if lines:
+                yield [line.rstrip("\r") for line in lines]
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError as e:
+        raise ImportFormatError(f"Input is not valid UTF-8: {str(e)}")
+    if pending:
+        yield [pending.rstrip("\r")]
+
+
+async def _lines(chunks):
+    async for lines in _line_batches(chunks):
+        for line in lines:
+            yield line
+
+
+def _parse_records(lines, first_line):
+    # [(line number, values)] for every record csv.reader finds in lines
+    reader = csv.reader(lines)
+    records = []
+    consumed = 0
+    try:
+        for values in reader:
+            records.append((first_line + consumed, values))
+            consumed = reader.line_num
+    except csv.Error as e:
+        raise ImportFormatError(f"Malformed CSV on line {first_line + consumed}: {str(e)}")
+    return records
+
+
+def _unterminated(lines):
+    # csv.reader (non-strict) ends an open quoted field at end of input;
+    # strict mode reports it instead
+    try:
+        for _ in csv.reader(lines, strict=True):
+            pass
+    except csv.Error as e:
+        return "unexpected end of data" in str(e)
+    return False
+
+
+async def _csv_records(chunks, max_record=IMPORT_MAX_RECORD_SIZE):
+    # Yields (line number, values) with csv.reader deciding where records end,
+    # so quoted fields may span lines and a stray quote inside an unquoted
+    # field is just a character. The last record of each parse may continue
+    # in the next chunk, so its lines are held back and parsed again with
+    # more input. Held lines are re-parsed only once at least as much new
+    # input has arrived, which keeps the total work linear.
+    held = []
+    held_size = 0
+    new_size = 0
+    first_line = 1
+    async for lines in _line_batches(chunks, max_record):
+        held.extend(line + "\n" for line in lines)
+        added = sum(len(line) + 1 for line in lines)
+        new_size += added
+        held_size += added
+        if new_size < held_size - new_size and held_size <= max_record:
+            continue
+        records = _parse_records(held, first_line)
+        for record in records[:-1]:
+            yield record
+        last_line = records[-1][0]
+        held = held[last_line - first_line:]
+        first_line = last_line
+        held_size = sum(len(line) for line in held)
+        new_size = 0
+        if held_size > max_record:
+            raise ImportFormatError(f"Record starting on line {first_line} is longer than {max_record} characters")
+    if held:
+        records = _parse_records(held, first_line)
+        for record in records[:-1]:
+            yield record
+        last_line = records[-1][0]
+        if _unterminated(held[last_line - first_line:]):
+            raise ImportFormatError(f"Unterminated quoted field starting on line {last_line}")
+        yield records[-1]
+
+
+async def _csv_rows(chunks):
+    # Yields (line number, row dict); the first record is the header
+    header = None
+    async for number, values in _csv_records(chunks):
+        if not values or (len(values) == 1 and not values[0].strip()):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield number, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield number, dict(zip(header, values))
+    if header is None:
+        raise ImportFormatError("CSV input has no header row")
+
+
+async def _ndjson_rows(chunks):
+    number = 0
+    async for line in _lines(chunks):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(row, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, row
+
+
+def _validation_message(error):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+
+class BulkImporter:
+    # Streams rows through validate -> (hash) -> COPY into a staging table ->
+    # merge, one batch at a time, so memory is bounded by batch_size whatever
+    # the input size. Each batch commits on its own: a failure part way keeps
+    # the batches already merged, and the report says how far the import got.
+    # With company_id set, rows of company-owned kinds (users) default to that
+    # company and rows naming any other company are rejected.
+    def __init__(self, kind, hashing_service=None, batch_size=IMPORT_BATCH_SIZE, pool="background", company_id=None):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"Unknown import kind: {kind}")
+        self.kind = IMPORT_KINDS[kind]
+        if self.kind.hashes_password and hashing_service is None:
+            raise ValueError(f"Importing {kind} needs a hashing service")
+        self.hashing_service = hashing_service
+        self.batch_size = batch_size
+        self.pool = pool
+        self.company_id = company_id
+
+    async def _hash_passwords(self, rows):
+        # Bounded to the worker count so interactive logins keep queue headroom
+        limit = asyncio.Semaphore(self.hashing_service.max_workers)
+
+        async def hash_one(password):
+            async with limit:
+                return await self.hashing_service.hash(password)
+
+        return await asyncio.gather(*(hash_one(row.password) for _, row in rows))
+
+    def _validate(self, batch):
+        # Pure CPU work (schema rules, email checks, bleach); runs in a thread
+        valid = []
+        rejected = []
+        for line, row in batch:
+            if isinstance(row, str):
+                rejected.append((line, row, None))
+                continue
+            field = self.kind.company_field if self.company_id is not None else None
+            if field and row.get(field) in (None, ""):
+                row = {**row, field: self.company_id}
+            try:
+                record = self.kind.schema(**row)
+            except ValidationError as e:
+                rejected.append((line, _validation_message(e), row.get("email")))
+                continue
+            if field and getattr(record, field) != self.company_id:
+                rejected.append((line, f"{field}: can only import into your own company", record.email))
+                continue
+            valid.append((line, record))
+        return valid, rejected
+
+    async def _store(self, valid, report):
+        if valid:
+            if self.kind.hashes_password:
+                hashes = await self._hash_passwords(valid)
+            else:
+                hashes = [None] * len(valid)
+            records = [
+                (line, *self.kind.to_record(row, hashed)) for (line, row), hashed in zip(valid, hashes)
+            ]
+            async with pool_manager.acquire(self.pool) as conn:
+                async with conn.transaction():
+                    await conn.execute(self.kind.staging_sql)
+                    await conn.copy_records_to_table(
+                        self.kind.staging_table, records=records, columns=("line", *self.kind.columns)
+                    )
+                    rejected = await conn.fetch(self.kind.merge_sql)
+            for row in rejected:
+                report.reject(row["line"], row["reason"], row["email"])
+            report.conflicts += len(rejected)
+            report.inserted += len(valid) - len(rejected)
+        report.batches += 1
+
+    async def _advance(self, batch, pending, report, on_progress):
+        # Validates this batch while the previous one is still loading, then
+        # starts loading it; at most two batches are held at once
+        valid, rejected = await asyncio.to_thread(self._validate, batch)
+        for line, reason, email in rejected:
+            report.reject(line, reason, email)
+        report.invalid += len(rejected)
+        report.rows += len(batch)
+        if pending is not None:
+            await pending
+            if on_progress is not None:
+                on_progress(report)
+        return asyncio.create_task(self._store(valid, report))
+
+    async def run(self, chunks, fmt, report, on_progress=None):
+        if fmt not in FORMATS:
+            raise ImportFormatError(f"Unsupported import format: {fmt}")
+        rows = _csv_rows(chunks) if fmt == "csv" else _ndjson_rows(chunks)
+        imports_in_progress[report.id] = report
+        pending = None
+        try:
+            batch = []
+            async for item in rows:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    pending = await self._advance(batch, pending, report, on_progress)
+                    batch = []
+            if batch:
+                pending = await self._advance(batch, pending, report, on_progress)
+            if pending is not None:
+                await pending
+                if on_progress is not None:
+                    on_progress(report)
+        finally:
+            if pending is not None and not pending.done():
+                # The input failed part way: abandon (roll back) the batch in flight
+                pending.cancel()
+                try:
+                    await pending
+                except asyncio.CancelledError:
+                    pass
+            report.finished = time.monotonic()
+            imports_in_progress.pop(report.id, None)
+        logger.info(
+            f"Imported {report.kind}: {report.inserted} inserted, {report.invalid} invalid, "
+            f"{report.conflicts} conflicts out of {report.rows} rows"
+        )
+        return report
+
+
+async def _file_chunks(path, chunk_size=1 << 16):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def _main(argv=None):
+    import argparse
+    import sys
+    from app.config import (
+        HASH_POOL_WORKERS, HASH_POOL_MAX_QUEUE, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS, BCRYPT_ROUNDS,
+    )
+    from app.database import close_db_pools
+    from app.hashing import HashingService
+
+    parser = argparse.ArgumentParser(description="Bulk import businesses or users from CSV or NDJSON")
+    parser.add_argument("kind", choices=sorted(IMPORT_KINDS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+
+    hashing_service = None
+    if IMPORT_KINDS[args.kind].hashes_password:
+        hashing_service = HashingService(max_workers=HASH_POOL_WORKERS, max_queue=HASH_POOL_MAX_QUEUE)
+        hashing_service.start()
+        if BCRYPT_ROUNDS is not None:
+            hashing_service.rounds = BCRYPT_ROUNDS
+        else:
+            await hashing_service.calibrate(BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS)
+
+    def progress(report):
+        print(
+            f"\r{report.rows} rows, {report.inserted} inserted, "
+            f"{report.invalid + report.conflicts} rejected", end="", file=sys.stderr, flush=True
+        )
+
+    report = ImportReport(args.kind, fmt)
+    try:
+        await BulkImporter(args.kind, hashing_service, args.batch_size).run(
+            _file_chunks(args.path), fmt, report, on_progress=progress
+        )
+    except ImportFormatError as e:
+        print(f"\nImport stopped: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        await close_db_pools()
+        if hashing_service is not None:
+            hashing_service.shutdown()
+    print(file=sys.stderr)
+    print(json.dumps(report.as_dict(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,153 @@
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+
+def parse_keyring(value):
+    # "id:secret,id:secret" -> [(id, secret), ...]; the first entry is the active key
+    keys = []
+    for item in value.split(","):
+        key_id, sep, secret = item.strip().partition(":")
+        if not sep or not key_id or not secret:
+            raise ValueError("Keys must be comma-separated 'id:secret' pairs")
+        keys.append((key_id, secret))
+    return keys
+
+
+# /metrics/ requires "Authorization: Bearer <METRICS_TOKEN>"; unset disables the endpoint
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Password hashing process pool
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+# Jobs allowed to wait for a free worker before new work is rejected with 503
+HASH_POOL_MAX_QUEUE = int(os.getenv("HASH_POOL_MAX_QUEUE", "64"))
+
+# Server-side OTP peppers as comma-separated "version:secret" pairs.
+# The first pair signs new OTPs; the rest only verify codes issued before a rotation.
+if not os.getenv("OTP_PEPPERS"):
+    raise ValueError("OTP_PEPPERS environment variable not set")
+OTP_PEPPERS = parse_keyring(os.getenv("OTP_PEPPERS"))
+
+# bcrypt cost calibration: the highest cost hashing within BCRYPT_TARGET_MS on
+# this host is chosen at startup. Set BCRYPT_ROUNDS to pin the cost instead.
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "16"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS")) if os.getenv("BCRYPT_ROUNDS") else None
+
+# Brute-force gate for /login/ and /verify-otp/: failures per account and per
+# client IP within the window before an exponential lockout kicks in
+ATTEMPT_LIMIT_ACCOUNT = int(os.getenv("ATTEMPT_LIMIT_ACCOUNT", "5"))
+ATTEMPT_LIMIT_IP = int(os.getenv("ATTEMPT_LIMIT_IP", "20"))
+ATTEMPT_WINDOW_SECONDS = int(os.getenv("ATTEMPT_WINDOW_SECONDS", "900"))
+LOCKOUT_BASE_SECONDS = int(os.getenv("LOCKOUT_BASE_SECONDS", "30"))
+LOCKOUT_MAX_SECONDS = int(os.getenv("LOCKOUT_MAX_SECONDS", "3600"))
+
+# Authentication mode: "session" (Redis-backed session cookie) or "token"
+# (short-lived signed JWT verified locally by each worker)
+AUTH_MODE = os.getenv("AUTH_MODE", "session")
+if AUTH_MODE not in ("session", "token"):
+    raise ValueError("AUTH_MODE must be 'session' or 'token'")
+# JWT signing keys as "kid:secret" pairs; the first signs new tokens
+JWT_KEYS = parse_keyring(os.getenv("JWT_KEYS")) if os.getenv("JWT_KEYS") else []
+if AUTH_MODE == "token" and not JWT_KEYS:
+    raise ValueError("JWT_KEYS environment variable not set")
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))
+# How often each worker pulls the revoked-token denylist from Redis
+TOKEN_DENYLIST_SYNC_SECONDS = float(os.getenv("TOKEN_DENYLIST_SYNC_SECONDS", "5"))
+
+# Redis sessions and the per-worker session cache in front of them
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "30"))
+# Bump to force every session and token issued under an older permission model to sign in again
+PERMISSIONS_VERSION = int(os.getenv("PERMISSIONS_VERSION", "1"))
+# Sliding expiry: refresh a session's TTL once less than this fraction of it remains,
+# at most once per session per worker within the dedupe window
+SESSION_REFRESH_FRACTION = float(os.getenv("SESSION_REFRESH_FRACTION", "0.5"))
+SESSION_REFRESH_DEDUPE_SECONDS = float(os.getenv("SESSION_REFRESH_DEDUPE_SECONDS", "10"))
+
+# Two-tier rate limiting: each worker leases up to RATE_LIMIT_LEASE_SIZE tokens
+# from Redis per client key and spends them locally for RATE_LIMIT_LEASE_SECONDS
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "10"))
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", "1"))
+RATE_LIMIT_LOCAL_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_KEYS", "10000"))
+# Limits below this never lease (every request asks Redis); leasing only pays
+# off for high limits, where a few tokens held per worker are a small share
+RATE_LIMIT_MIN_LEASED_LIMIT = int(os.getenv("RATE_LIMIT_MIN_LEASED_LIMIT", "100"))
+
+# asyncpg pool sizing and connection lifecycle (keep workers x DB_POOL_MAX_SIZE
+# below Postgres max_connections)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+DB_CONN_MAX_LIFETIME = float(os.getenv("DB_CONN_MAX_LIFETIME", "1800"))
+DB_CONN_MAX_QUERIES = int(os.getenv("DB_CONN_MAX_QUERIES", "50000"))
+DB_CONN_MAX_IDLE = float(os.getenv("DB_CONN_MAX_IDLE", "300"))
+# Per-connection asyncpg statement cache; must hold every statement the API
+# generates (queries.CACHED_STATEMENT_COUNT) so none is evicted and re-parsed
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Optional autoscaler: moves the pool's concurrency target between the min and
+# max size based on the p95 acquire wait measured every interval
+DB_POOL_AUTOSCALE = os.getenv("DB_POOL_AUTOSCALE", "false").lower() in ("1", "true", "yes")
+DB_AUTOSCALE_INTERVAL = float(os.getenv("DB_AUTOSCALE_INTERVAL", "10"))
+DB_AUTOSCALE_HIGH_WAIT_MS = float(os.getenv("DB_AUTOSCALE_HIGH_WAIT_MS", "20"))
+DB_AUTOSCALE_LOW_WAIT_MS = float(os.getenv("DB_AUTOSCALE_LOW_WAIT_MS", "2"))
+# Optional read replica and a small pool for background jobs
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DB_REPLICA_POOL_MIN_SIZE = int(os.getenv("DB_REPLICA_POOL_MIN_SIZE", str(DB_POOL_MIN_SIZE)))
+DB_REPLICA_POOL_MAX_SIZE = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+DB_BACKGROUND_POOL_MIN_SIZE = int(os.getenv("DB_BACKGROUND_POOL_MIN_SIZE", "1"))
+DB_BACKGROUND_POOL_MAX_SIZE = int(os.getenv("DB_BACKGROUND_POOL_MAX_SIZE", "5"))
+# Exports hold a connection for as long as the client takes to download, so
+# they get their own pool (opened on first export) when the replica is not used
+DB_EXPORT_POOL_MAX_SIZE = int(os.getenv("DB_EXPORT_POOL_MAX_SIZE", "3"))
+# Replica routing: reads fall back to the primary when the replica lags more than
+# DB_REPLICA_MAX_LAG_SECONDS, and for DB_READ_YOUR_WRITES_SECONDS after a client writes
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "2"))
+DB_REPLICA_PROBE_SECONDS = float(os.getenv("DB_REPLICA_PROBE_SECONDS", "1"))
+DB_READ_YOUR_WRITES_SECONDS = int(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# Bulk import: rows are validated, hashed and loaded this many at a time, and at
+# most IMPORT_MAX_REPORTED_ERRORS rejected rows are listed in the report
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+# Longest record (characters, including multi-line quoted fields) before an
+# import is stopped; bounds memory when a stray quote never closes
+IMPORT_MAX_RECORD_SIZE = int(os.getenv("IMPORT_MAX_RECORD_SIZE", "65536"))
+
+# Export: rows fetched from the server-side cursor per round trip
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Business search: minimum pg_trgm word similarity for a fuzzy name match
+# (lower tolerates more typos; pg_trgm's own default is 0.6)
+SEARCH_NAME_SIMILARITY = float(os.getenv("SEARCH_NAME_SIMILARITY", "0.5"))
+
+# Where OTPs live: "postgres" (otps table) or "redis" (keys with native TTL)
+OTP_STORE = os.getenv("OTP_STORE", "postgres")
+if OTP_STORE not in ("postgres", "redis"):
+    raise ValueError("OTP_STORE must be 'postgres' or 'redis'")
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+
+# Maintenance scheduler: one worker across all hosts wins a Postgres advisory
+# lock (SCHEDULER_LOCK_ID) and runs the periodic jobs; the rest retry the
+# election every SCHEDULER_ELECTION_SECONDS
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_LOCK_ID = int(os.getenv("SCHEDULER_LOCK_ID", "730101"))
+SCHEDULER_ELECTION_SECONDS = float(os.getenv("SCHEDULER_ELECTION_SECONDS", "15"))
+OTP_PURGE_INTERVAL_SECONDS = float(os.getenv("OTP_PURGE_INTERVAL_SECONDS", "60"))
+OTP_PURGE_BATCH_SIZE = int(os.getenv("OTP_PURGE_BATCH_SIZE", "1000"))
+
+# Activity log: events queue in memory (bounded) and are written with COPY in
+# batches of ACTIVITY_BATCH_SIZE, or every ACTIVITY_FLUSH_SECONDS. When the
+# queue is full a handler waits up to ACTIVITY_ENQUEUE_TIMEOUT before the event
+# is dropped. Monthly partitions older than ACTIVITY_RETENTION_MONTHS are
+# dropped by the scheduler (0 keeps everything).
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "10000"))
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "500"))
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "1"))
+ACTIVITY_ENQUEUE_TIMEOUT = float(os.getenv("ACTIVITY_ENQUEUE_TIMEOUT", "0.5"))
+ACTIVITY_SHUTDOWN_TIMEOUT = float(os.getenv("ACTIVITY_SHUTDOWN_TIMEOUT", "10"))
+ACTIVITY_RETENTION_MONTHS = int(os.getenv("ACTIVITY_RETENTION_MONTHS", "0"))
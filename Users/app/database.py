@@ -1,7 +1,20 @@
 import asyncpg
+from app.queries import check_statements, CACHED_STATEMENT_COUNT
+from app.config import (
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_ACQUIRE_TIMEOUT, DB_COMMAND_TIMEOUT,
+    DB_CONN_MAX_LIFETIME, DB_CONN_MAX_QUERIES, DB_CONN_MAX_IDLE, DB_STATEMENT_CACHE_SIZE,
+    DB_POOL_AUTOSCALE, DB_AUTOSCALE_INTERVAL, DB_AUTOSCALE_HIGH_WAIT_MS, DB_AUTOSCALE_LOW_WAIT_MS,
+    DATABASE_REPLICA_URL, DB_REPLICA_POOL_MIN_SIZE, DB_REPLICA_POOL_MAX_SIZE,
+    DB_BACKGROUND_POOL_MIN_SIZE, DB_BACKGROUND_POOL_MAX_SIZE, DB_EXPORT_POOL_MAX_SIZE,
+    DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_PROBE_SECONDS, SEARCH_NAME_SIMILARITY,
+)
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
+import bisect
 import os
 import logging
+import time
 
 load_dotenv()
 
@@ -12,34 +25,403 @@ if not DATABASE_URL:
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Global variable for the asyncpg pool
-db_pool = None
+# Acquire wait histogram bucket upper bounds, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
 
-async def init_db_pool():
-    global db_pool
-    if db_pool is None:
+
+class DatabaseBusyError(Exception):
+    pass
+
+
+class PoolStats:
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        # Waits since the autoscaler last looked
+        self.recent_waits = []
+
+    def observe_wait(self, seconds):
+        wait_ms = seconds * 1000
+        self.acquired += 1
+        self.buckets[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+        self.recent_waits.append(wait_ms)
+        if len(self.recent_waits) > 10000:
+            del self.recent_waits[:5000]
+
+    def take_recent_p95(self):
+        waits, self.recent_waits = self.recent_waits, []
+        if not waits:
+            return None
+        waits.sort()
+        return waits[int(len(waits) * 0.95) - 1 if len(waits) >= 20 else -1]
+
+    def histogram(self):
+        labels = [f"le_{bound}ms" for bound in WAIT_BUCKETS_MS] + ["gt_5000ms"]
+        return dict(zip(labels, self.buckets))
+
+
+class ManagedPool:
+    # An asyncpg pool plus acquire metrics, connection recycling, and an
+    # optional autoscaler. asyncpg cannot resize a pool, so the pool is created
+    # at max_size and the autoscaler moves a concurrency target between
+    # min_size and max_size; connections above the target sit idle and are
+    # closed after max_idle seconds.
+    def __init__(self, name, dsn, min_size, max_size, acquire_timeout, command_timeout,
+                 max_lifetime, max_queries, max_idle, autoscale=False):
+        self.name = name
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.command_timeout = command_timeout
+        self.max_lifetime = max_lifetime
+        self.max_queries = max_queries
+        self.max_idle = max_idle
+        self.autoscale = autoscale
+        self.target_size = max_size if not autoscale else min_size
+        self.pool = None
+        self.stats = PoolStats()
+        self._in_use = 0
+        self._slot_freed = asyncio.Condition()
+        # Backend PID -> monotonic time the connection was opened
+        self._opened_at = {}
+        self._autoscaler = None
+
+    async def _init_connection(self, conn):
+        self._opened_at[conn.get_server_pid()] = time.monotonic()
+
+    async def open(self):
+        self.pool = await asyncpg.create_pool(
+            dsn=self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            command_timeout=self.command_timeout,
+            max_queries=self.max_queries,
+            max_inactive_connection_lifetime=self.max_idle,
+            init=self._init_connection,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            server_settings={"pg_trgm.word_similarity_threshold": str(SEARCH_NAME_SIMILARITY)},
+        )
+        if self.autoscale:
+            self._autoscaler = asyncio.create_task(self._autoscale_loop())
+        logger.info(f"Asyncpg pool '{self.name}' initialized ({self.min_size}-{self.max_size} connections)")
+
+    async def close(self):
+        if self._autoscaler is not None:
+            self._autoscaler.cancel()
+            try:
+                await self._autoscaler
+            except asyncio.CancelledError:
+                pass
+            self._autoscaler = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logger.info(f"Asyncpg pool '{self.name}' closed")
+
+    async def _wait_for_slot(self, deadline):
+        async with self._slot_freed:
+            while self._in_use >= self.target_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                await asyncio.wait_for(self._slot_freed.wait(), remaining)
+            self._in_use += 1
+
+    async def _free_slot(self):
+        async with self._slot_freed:
+            self._in_use -= 1
+            self._slot_freed.notify()
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        try:
+            await self._wait_for_slot(deadline)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise DatabaseBusyError(f"Timed out waiting for a '{self.name}' connection")
+        try:
+            try:
+                conn = await self.pool.acquire(timeout=max(deadline - time.monotonic(), 0.001))
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                raise DatabaseBusyError(f"Timed out waiting for a '{self.name}' connection")
+            self.stats.observe_wait(time.monotonic() - started)
+            try:
+                yield conn
+            finally:
+                await self._release(conn)
+        finally:
+            await self._free_slot()
+
+    async def _release(self, conn):
+        # Recycle connections past their max lifetime; the pool reconnects lazily
+        opened_at = self._opened_at.get(conn.get_server_pid())
+        if self.max_lifetime and opened_at is not None and time.monotonic() - opened_at > self.max_lifetime:
+            self._opened_at.pop(conn.get_server_pid(), None)
+            self.stats.recycled += 1
+            try:
+                await conn.close(timeout=5)
+            except Exception as e:
+                logger.warning(f"Failed to close recycled connection: {str(e)}")
+        await self.pool.release(conn)
+
+    async def _autoscale_loop(self):
+        while True:
+            await asyncio.sleep(DB_AUTOSCALE_INTERVAL)
+            p95 = self.stats.take_recent_p95()
+            if p95 is None:
+                continue
+            if p95 > DB_AUTOSCALE_HIGH_WAIT_MS and self.target_size < self.max_size:
+                self.target_size = min(self.max_size, self.target_size + max(1, self.target_size // 4))
+                logger.info(f"Pool '{self.name}' scaled up to {self.target_size} (p95 wait {p95:.1f} ms)")
+                async with self._slot_freed:
+                    self._slot_freed.notify_all()
+            elif p95 < DB_AUTOSCALE_LOW_WAIT_MS and self.target_size > self.min_size and self._in_use < self.target_size - 1:
+                self.target_size -= 1
+                logger.info(f"Pool '{self.name}' scaled down to {self.target_size} (p95 wait {p95:.1f} ms)")
+
+    def metrics(self):
+        if self.pool is None:
+            return {"open": False}
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "open": True,
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "target_size": self.target_size,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "acquired": self.stats.acquired,
+            "timeouts": self.stats.timeouts,
+            "recycled": self.stats.recycled,
+            "acquire_wait_ms": self.stats.histogram(),
+        }
+
+
+class PoolManager:
+    # Named pools (primary, replica, background jobs, exports). Each pool is created at
+    # most once: the first caller opens it under a per-name lock while
+    # concurrent callers wait for it, so a burst of first requests cannot leak
+    # extra pools. Optional pools (the replica, exports) are not opened by
+    # start(), so an unreachable one cannot stop the app from booting and an
+    # unused one holds no connections; they open on first use.
+    def __init__(self):
+        self._specs = {}
+        self._pools = {}
+        self._locks = {}
+        self._optional = set()
+
+    def register(self, name, dsn, optional=False, **settings):
+        self._specs[name] = (dsn, settings)
+        self._locks[name] = asyncio.Lock()
+        if optional:
+            self._optional.add(name)
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def is_open(self, name):
+        return name in self._pools
+
+    async def get(self, name="primary"):
+        pool = self._pools.get(name)
+        if pool is not None:
+            return pool
+        async with self._locks[name]:
+            pool = self._pools.get(name)
+            if pool is None:
+                dsn, settings = self._specs[name]
+                pool = ManagedPool(name, dsn, **settings)
+                try:
+                    await pool.open()
+                except Exception as e:
+                    logger.error(f"Failed to initialize asyncpg pool '{name}': {str(e)}")
+                    raise
+                self._pools[name] = pool
+            return pool
+
+    @asynccontextmanager
+    async def acquire(self, name="primary"):
+        # async with pool_manager.acquire("background") as conn: ... releases the
+        # connection and its slot as soon as the block exits, even on error
+        pool = await self.get(name)
+        async with pool.acquire() as conn:
+            yield conn
+
+    async def start(self):
+        # Warm every required pool in parallel
+        await asyncio.gather(*(self.get(name) for name in self._specs if name not in self._optional))
+
+    async def close(self):
+        # Drain in reverse registration order: background jobs first, primary last
+        for name in reversed(list(self._specs)):
+            pool = self._pools.pop(name, None)
+            if pool is not None:
+                await pool.close()
+
+    def metrics(self):
+        return {
+            name: self._pools[name].metrics() if name in self._pools else {"open": False}
+            for name in self._specs
+        }
+
+
+class ReplicaMonitor:
+    # Probes replica lag on an interval; reads fall back to the primary while
+    # the replica is missing, unreachable or lagging more than max_lag seconds.
+    # A replica that has replayed everything it received counts as 0 s behind,
+    # so an idle primary does not look like lag. The probe also opens the
+    # replica pool, retrying with backoff while the replica is unreachable.
+    LAG_QUERY = (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, manager, max_lag_seconds, probe_seconds):
+        self.manager = manager
+        self.max_lag_seconds = max_lag_seconds
+        self.probe_seconds = probe_seconds
+        self.lag_seconds = None
+        self.routed_to_replica = 0
+        self.routed_to_primary = 0
+        self._task = None
+        self._open_backoff = probe_seconds
+        self._next_open_attempt = 0.0
+
+    def usable(self):
+        return self.lag_seconds is not None and self.lag_seconds <= self.max_lag_seconds
+
+    async def probe(self):
+        opening = not self.manager.is_open("replica")
+        if opening and time.monotonic() < self._next_open_attempt:
+            return
         try:
-            db_pool = await asyncpg.create_pool(
-                dsn=DATABASE_URL,
-                min_size=5,  # Minimum number of connections
-                max_size=20,  # Maximum number of connections
-                command_timeout=60  # Timeout for queries
-            )
-            logger.info("Asyncpg connection pool initialized")
+            pool = await self.manager.get("replica")
+            async with pool.acquire() as conn:
+                self.lag_seconds = float(await conn.fetchval(self.LAG_QUERY))
+            self._open_backoff = self.probe_seconds
         except Exception as e:
-            logger.error(f"Failed to initialize asyncpg pool: {str(e)}")
-            raise
-    return db_pool
-
-async def close_db_pool():
-    global db_pool
-    if db_pool is not None:
-        await db_pool.close()
-        logger.info("Asyncpg connection pool closed")
-        db_pool = None
-
-async def get_db():
-    if db_pool is None:
-        await init_db_pool()
-    async with db_pool.acquire() as conn:
-        yield conn
\ No newline at end of file
+            if self.lag_seconds is not None:
+                logger.warning(f"Replica probe failed, routing reads to primary: {str(e)}")
+            self.lag_seconds = None
+            if opening:
+                self._next_open_attempt = time.monotonic() + self._open_backoff
+                self._open_backoff = min(self._open_backoff * 2, 60)
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_seconds)
+
+    def start(self):
+        if "replica" in self.manager and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def route(self, prefer_primary=False):
+        if prefer_primary or not self.usable():
+            self.routed_to_primary += 1
+            return "primary"
+        self.routed_to_replica += 1
+        return "replica"
+
+    def metrics(self):
+        return {
+            "configured": "replica" in self.manager,
+            "lag_seconds": self.lag_seconds,
+            "max_lag_seconds": self.max_lag_seconds,
+            "routed_to_replica": self.routed_to_replica,
+            "routed_to_primary": self.routed_to_primary,
+        }
+
+
+pool_manager = PoolManager()
+pool_manager.register(
+    "primary", DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    acquire_timeout=DB_ACQUIRE_TIMEOUT,
+    command_timeout=DB_COMMAND_TIMEOUT,
+    max_lifetime=DB_CONN_MAX_LIFETIME,
+    max_queries=DB_CONN_MAX_QUERIES,
+    max_idle=DB_CONN_MAX_IDLE,
+    autoscale=DB_POOL_AUTOSCALE
+)
+if DATABASE_REPLICA_URL:
+    pool_manager.register(
+        "replica", DATABASE_REPLICA_URL, optional=True,
+        min_size=DB_REPLICA_POOL_MIN_SIZE,
+        max_size=DB_REPLICA_POOL_MAX_SIZE,
+        acquire_timeout=DB_ACQUIRE_TIMEOUT,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        max_lifetime=DB_CONN_MAX_LIFETIME,
+        max_queries=DB_CONN_MAX_QUERIES,
+        max_idle=DB_CONN_MAX_IDLE,
+        autoscale=DB_POOL_AUTOSCALE
+    )
+# Small separate pool so maintenance and bulk jobs never starve request handlers
+pool_manager.register(
+    "background", DATABASE_URL,
+    min_size=DB_BACKGROUND_POOL_MIN_SIZE,
+    max_size=DB_BACKGROUND_POOL_MAX_SIZE,
+    acquire_timeout=DB_ACQUIRE_TIMEOUT,
+    command_timeout=None,
+    max_lifetime=DB_CONN_MAX_LIFETIME,
+    max_queries=DB_CONN_MAX_QUERIES,
+    max_idle=DB_CONN_MAX_IDLE
+)
+# Streaming exports: slow downloads must not starve the background jobs above
+pool_manager.register(
+    "export", DATABASE_URL, optional=True,
+    min_size=0,
+    max_size=DB_EXPORT_POOL_MAX_SIZE,
+    acquire_timeout=DB_ACQUIRE_TIMEOUT,
+    command_timeout=None,
+    max_lifetime=DB_CONN_MAX_LIFETIME,
+    max_queries=DB_CONN_MAX_QUERIES,
+    max_idle=DB_CONN_MAX_IDLE
+)
+
+replica_monitor = ReplicaMonitor(pool_manager, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_PROBE_SECONDS)
+
+async def init_db_pools():
+    if DB_STATEMENT_CACHE_SIZE < CACHED_STATEMENT_COUNT:
+        logger.warning(
+            f"DB_STATEMENT_CACHE_SIZE={DB_STATEMENT_CACHE_SIZE} is below the {CACHED_STATEMENT_COUNT} "
+            "statements the API can generate; some will be re-parsed after eviction"
+        )
+    await pool_manager.start()
+    async with pool_manager.acquire() as conn:
+        await check_statements(conn)
+    # Reads use the primary until the monitor's first successful probe
+    replica_monitor.start()
+    logger.info("Asyncpg connection pools initialized")
+
+async def close_db_pools():
+    await replica_monitor.stop()
+    await pool_manager.close()
+    logger.info("Asyncpg connection pools closed")
+
+def pool_metrics():
+    return {**pool_manager.metrics(), "replica_routing": replica_monitor.metrics()}
+
+# FastAPI dependency form; elsewhere use pool_manager.acquire(name)
+async def get_db(name="primary"):
+    async with pool_manager.acquire(name) as conn:
+        yield conn
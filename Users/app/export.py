@@ -0,0 +1,133 @@
+from app.config import EXPORT_BATCH_SIZE
+from app.database import pool_manager
+from contextlib import AsyncExitStack
+from datetime import date, datetime
+import csv
+import io
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Exportable columns per table; anything secret (users.password) is never listed
+EXPORT_COLUMNS = {
+    "business": (
+        "Business",
+        ("id", "company_name", "email", "phone", "hq", "operations", "website", "details", "verified", "created_at"),
+    ),
+    "users": (
+        "users",
+        ("id", "name", "email", "phone", "role", "company_id", "created_at"),
+    ),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_columns(kind, columns=None):
+    # Validates a comma-separated projection against the allowlist, keeping the caller's order
+    _, allowed = EXPORT_COLUMNS[kind]
+    if not columns:
+        return allowed
+    selected = [name.strip() for name in columns.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in allowed]
+    if unknown:
+        raise ExportError(f"Unknown columns: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(selected))
+
+
+def export_query(kind, columns, company_id=None):
+    # Column names come from the allowlist, so interpolating them is safe
+    table, _ = EXPORT_COLUMNS[kind]
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    args = ()
+    if company_id is not None:
+        query += " WHERE company_id = $1"
+        args = (company_id,)
+    return query + " ORDER BY id", args
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _encode_ndjson(columns, rows):
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=_json_value, separators=(",", ":")) + "\n" for row in rows
+    )
+
+
+def _encode_csv(columns, rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(columns)
+    writer.writerows(
+        [value.isoformat() if isinstance(value, (datetime, date)) else value for value in row] for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def open_export(kind, fmt, columns, company_id=None, compress=False, pool="export",
+                      batch_size=EXPORT_BATCH_SIZE):
+    # Takes the connection before anything is sent, so a saturated pool raises
+    # DatabaseBusyError (a 503) from the endpoint instead of cutting off a
+    # response that already went out as a 200. Returns the chunk iterator and
+    # a close callback for after the response: the iterator returns the
+    # connection when it finishes, the callback when streaming was cut short
+    # or never began.
+    stack = AsyncExitStack()
+    conn = await stack.enter_async_context(pool_manager.acquire(pool))
+    chunks = stream_export(conn, kind, fmt, columns, company_id, compress, batch_size, release=stack.aclose)
+
+    async def close():
+        await chunks.aclose()
+        await stack.aclose()
+
+    return chunks, close
+
+
+async def stream_export(conn, kind, fmt, columns, company_id=None, compress=False, batch_size=EXPORT_BATCH_SIZE,
+                        release=None):
+    # Yields encoded chunks batch by batch from a server-side cursor, inside a
+    # read-only REPEATABLE READ transaction so the export is one consistent
+    # snapshot. Only one batch is held in memory at a time.
+    query, args = export_query(kind, columns, company_id)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    rows_sent = 0
+    try:
+        if fmt == "csv":
+            header = _encode_csv(columns, [], header=True).encode()
+            yield compressor.compress(header) if compressor else header
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            # Prepared outside the statement cache: every column list is a new
+            # statement and would push the API's cached ones out
+            statement = await conn.prepare(query)
+            cursor = await statement.cursor(*args)
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                rows_sent += len(rows)
+                if fmt == "csv":
+                    chunk = _encode_csv(columns, rows).encode()
+                else:
+                    chunk = _encode_ndjson(columns, rows).encode()
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+    finally:
+        if release is not None:
+            await release()
+    if compressor:
+        yield compressor.flush()
+    logger.info(f"Exported {rows_sent} {kind} rows as {fmt}{' (gzip)' if compress else ''}")
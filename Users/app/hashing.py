@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Password Hashing (one context per worker process)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Contexts with a calibrated minimum cost, cached per worker process
+_contexts = {}
+
+
+class HashingOverloadedError(Exception):
+    pass
+
+
+def _context(rounds):
+    if rounds is None:
+        return pwd_context
+    context = _contexts.get(rounds)
+    if context is None:
+        # Only a floor: needs_update() flags weaker hashes but leaves stronger
+        # ones alone, so a slower host or worker never downgrades them
+        context = pwd_context.copy(
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+        )
+        _contexts[rounds] = context
+    return context
+
+
+# Worker functions run inside the process pool. They return the wall-clock
+# time the job started so the event loop side can measure queue wait.
+def _hash_secret(secret, rounds):
+    started = time.time()
+    hashed = _context(rounds).hash(secret)
+    return hashed, started, time.time() - started
+
+
+def _verify_secret(secret, hashed, rounds):
+    started = time.time()
+    context = _context(rounds)
+    valid = context.verify(secret, hashed)
+    needs_update = valid and context.needs_update(hashed)
+    return (valid, needs_update), started, time.time() - started
+
+
+def _benchmark_rounds(rounds):
+    started = time.perf_counter()
+    _context(rounds).hash("calibration-secret")
+    return time.perf_counter() - started
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class HashingService:
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        # bcrypt cost for new hashes; None keeps the passlib default until calibrated
+        self.rounds = None
+        self._in_flight = 0
+        self._rejected = 0
+        self._wait = _Timing()
+        self._hash = _Timing()
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"Hashing pool started with {self.max_workers} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Hashing pool stopped")
+
+    @property
+    def queue_depth(self):
+        return max(0, self._in_flight - self.max_workers)
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self.start()
+        if self.queue_depth >= self.max_queue:
+            self._rejected += 1
+            logger.warning(f"Hashing queue full ({self.queue_depth} waiting), rejecting job")
+            raise HashingOverloadedError()
+        self._in_flight += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, elapsed = await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+        self._wait.observe(max(0.0, started - submitted))
+        self._hash.observe(elapsed)
+        return result
+
+    async def calibrate(self, target_ms, min_rounds, max_rounds):
+        # Pick the highest bcrypt cost whose hash time on this host fits the budget
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        chosen = min_rounds
+        for rounds in range(min_rounds, max_rounds + 1):
+            # Best of two runs, so a single scheduler hiccup doesn't lower the cost
+            samples = [await loop.run_in_executor(self._executor, _benchmark_rounds, rounds) for _ in range(2)]
+            elapsed_ms = min(samples) * 1000
+            logger.info(f"bcrypt cost {rounds}: {elapsed_ms:.1f} ms")
+            if elapsed_ms > target_ms:
+                if rounds == min_rounds:
+                    logger.warning(f"bcrypt cost {min_rounds} exceeds the {target_ms} ms budget; using it anyway")
+                break
+            chosen = rounds
+        self.rounds = chosen
+        logger.info(f"Calibrated bcrypt cost: {chosen} (budget {target_ms} ms)")
+        return chosen
+
+    async def hash(self, secret):
+        return await self._run(_hash_secret, secret, self.rounds)
+
+    async def verify(self, secret, hashed):
+        valid, _ = await self._run(_verify_secret, secret, hashed, self.rounds)
+        return valid
+
+    async def verify_and_check(self, secret, hashed):
+        # Returns (valid, needs_update); needs_update means the hash is weaker than the current cost
+        return await self._run(_verify_secret, secret, hashed, self.rounds)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "bcrypt_rounds": self.rounds,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "rejected": self._rejected,
+            "wait_time": self._wait.snapshot(),
+            "hash_time": self._hash.snapshot(),
+        }
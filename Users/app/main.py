@@ -1,16 +1,40 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, status, Response
-from fastapi.responses import JSONResponse
-from app.schemas import UserBusiness,Business, OTPGenerateRequest, OTPGenerateResponse, OTPVerifyRequest, OTPVerifyResponse, User, UserCreate
-from app.database import get_db, init_db_pool, close_db_pool
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status, Response, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from app.schemas import UserBusiness,Business, BusinessPage, BusinessSearchPage, CompanyUserPage, OTPGenerateRequest, OTPGenerateResponse, OTPVerifyRequest, OTPVerifyResponse, User, UserCreate, Principal
+from app.database import get_db, pool_manager, init_db_pools, close_db_pools, pool_metrics, replica_monitor, DatabaseBusyError, DATABASE_URL
+from app import queries
+from app.hashing import HashingService, HashingOverloadedError
+from app.otp import OtpHasher
+from app.otp_store import PostgresOtpStore, RedisOtpStore, OTP_MISSING, OTP_EXPIRED, OTP_INVALID, OTP_NO_BUSINESS, purge_expired_otps
+from app.scheduler import Scheduler
+from app.activity import ActivityLog, maintain_activity_partitions
+from app.attempts import AttemptGate, TooManyAttemptsError
+from app.ratelimit import Limit, RateLimiter, limiter_backend, client_email
+from app.tokens import TokenService, TokenDenylist, TokenError
+from app.sessions import SessionStore, SessionCache, principal_record, principal_from_record, session_handle
+from app.export import open_export, export_columns, ExportError, EXPORT_COLUMNS, FORMATS as EXPORT_FORMATS
+from app.bulk_import import BulkImporter, ImportReport, ImportFormatError, IMPORT_KINDS, import_format, imports_in_progress
+from app.config import (
+    HASH_POOL_WORKERS, HASH_POOL_MAX_QUEUE, OTP_PEPPERS,
+    BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS, BCRYPT_ROUNDS,
+    ATTEMPT_LIMIT_ACCOUNT, ATTEMPT_LIMIT_IP, ATTEMPT_WINDOW_SECONDS, LOCKOUT_BASE_SECONDS, LOCKOUT_MAX_SECONDS,
+    AUTH_MODE, JWT_KEYS, ACCESS_TOKEN_TTL_SECONDS, TOKEN_DENYLIST_SYNC_SECONDS,
+    SESSION_TTL_SECONDS, SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SECONDS, PERMISSIONS_VERSION,
+    SESSION_REFRESH_FRACTION, SESSION_REFRESH_DEDUPE_SECONDS, DB_READ_YOUR_WRITES_SECONDS,
+    OTP_STORE, OTP_TTL_SECONDS,
+    SCHEDULER_ENABLED, SCHEDULER_LOCK_ID, SCHEDULER_ELECTION_SECONDS, OTP_PURGE_INTERVAL_SECONDS, OTP_PURGE_BATCH_SIZE,
+    ACTIVITY_QUEUE_SIZE, ACTIVITY_BATCH_SIZE, ACTIVITY_FLUSH_SECONDS, ACTIVITY_ENQUEUE_TIMEOUT, ACTIVITY_SHUTDOWN_TIMEOUT,
+    ACTIVITY_RETENTION_MONTHS, METRICS_TOKEN,
+)
 import asyncpg
+import base64
+import hmac
+import html
 import random
 import string
-import uuid
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
+from datetime import datetime, timezone
 import redis.asyncio as redis
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
 import asyncio
 import logging
 from pydantic import ValidationError
@@ -21,12 +45,60 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
-# Password Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password Hashing (bcrypt runs in a process pool, off the event loop)
+hashing_service = HashingService(max_workers=HASH_POOL_WORKERS, max_queue=HASH_POOL_MAX_QUEUE)
+# OTP digests (keyed HMAC; legacy bcrypt rows still verify through the hashing pool)
+otp_hasher = OtpHasher(OTP_PEPPERS, legacy_verify=hashing_service.verify)
 
 # Redis client for session storage
 redis_client = redis.from_url("redis://:Alpha_1997@redis:6379", encoding="utf-8", decode_responses=True)
 
+# OTP storage: the otps table, or Redis keys with native expiry (OTP_STORE)
+if OTP_STORE == "redis":
+    otp_store = RedisOtpStore(redis_client, otp_hasher, OTP_TTL_SECONDS)
+else:
+    otp_store = PostgresOtpStore(otp_hasher, OTP_TTL_SECONDS)
+# Failed verification outcomes -> (log message, response message)
+OTP_FAILURES = {
+    OTP_MISSING: ("No OTP found", "No OTP found for this email"),
+    OTP_EXPIRED: ("Expired OTP", "OTP has expired"),
+    OTP_INVALID: ("Invalid OTP", "Invalid OTP"),
+}
+
+# Sessions with sliding expiry, and a per-worker cache invalidated over Redis pub/sub
+session_store = SessionStore(
+    redis_client, SESSION_TTL_SECONDS, SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SECONDS),
+    SESSION_REFRESH_FRACTION, SESSION_REFRESH_DEDUPE_SECONDS
+)
+
+# Signed access tokens (AUTH_MODE=token); revocations sync from Redis to every worker
+token_service = TokenService(
+    JWT_KEYS, ACCESS_TOKEN_TTL_SECONDS, TokenDenylist(redis_client, TOKEN_DENYLIST_SYNC_SECONDS)
+)
+
+# Brute-force gates, checked in Redis before any database query or bcrypt work
+login_gate = AttemptGate(
+    redis_client, "login", ATTEMPT_LIMIT_ACCOUNT, ATTEMPT_LIMIT_IP,
+    ATTEMPT_WINDOW_SECONDS, LOCKOUT_BASE_SECONDS, LOCKOUT_MAX_SECONDS
+)
+otp_gate = AttemptGate(
+    redis_client, "otp", ATTEMPT_LIMIT_ACCOUNT, ATTEMPT_LIMIT_IP,
+    ATTEMPT_WINDOW_SECONDS, LOCKOUT_BASE_SECONDS, LOCKOUT_MAX_SECONDS
+)
+
+# Periodic maintenance, run only by the worker holding the scheduler's advisory lock
+scheduler = Scheduler(DATABASE_URL, SCHEDULER_LOCK_ID, SCHEDULER_ELECTION_SECONDS)
+# Rows left behind by the Postgres OTP store (also drains them after switching to Redis)
+scheduler.register("purge_expired_otps", OTP_PURGE_INTERVAL_SECONDS, lambda: purge_expired_otps(OTP_PURGE_BATCH_SIZE))
+scheduler.register(
+    "activity_partitions", 3600, lambda: maintain_activity_partitions(retention_months=ACTIVITY_RETENTION_MONTHS)
+)
+
+# Who-did-what timeline, queued in memory and written to Postgres in batches
+activity_log = ActivityLog(
+    ACTIVITY_QUEUE_SIZE, ACTIVITY_BATCH_SIZE, ACTIVITY_FLUSH_SECONDS, ACTIVITY_ENQUEUE_TIMEOUT, ACTIVITY_SHUTDOWN_TIMEOUT
+)
+
 # Custom exception handlers
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request: Request, exc: ValidationError):
@@ -44,6 +116,32 @@ async def redis_connection_exception_handler(request: Request, exc: redis.Connec
         content={"detail": "Failed to connect to Redis. Please try again later."}
     )
 
+@app.exception_handler(DatabaseBusyError)
+async def database_busy_exception_handler(request: Request, exc: DatabaseBusyError):
+    logger.error(f"Database pool exhausted: {str(exc)}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy. Please try again later."},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(HashingOverloadedError)
+async def hashing_overloaded_exception_handler(request: Request, exc: HashingOverloadedError):
+    logger.error("Password hashing queue is full")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy. Please try again later."},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(TooManyAttemptsError)
+async def too_many_attempts_exception_handler(request: Request, exc: TooManyAttemptsError):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many failed attempts. Please try again later."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.exception_handler(asyncpg.PostgresError)
 async def postgres_exception_handler(request: Request, exc: asyncpg.PostgresError):
     logger.error(f"Database error: {str(exc)}")
@@ -65,31 +163,174 @@ async def get_db_conn():
     async for conn in get_db():
         yield conn
 
-# Dependency for authenticated user
-async def get_current_user(request: Request):
-    session_id = request.cookies.get("session_id")
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    user_data = await redis_client.get(f"session:{session_id}")
-    if not user_data:
+# Read-your-writes: this request or a recent one from the same client wrote to the primary
+def wrote_recently(request: Request):
+    return getattr(request.state, "db_wrote", False) or "recent_write" in request.cookies
+
+# Dependency for read-only queries: served by the replica unless it is lagging
+# or this client has just written (read-your-writes)
+async def get_db_read_conn(request: Request):
+    async for conn in get_db(replica_monitor.route(wrote_recently(request))):
+        yield conn
+
+# Pin this client's reads to the primary for a few seconds after a write
+def mark_recent_write(request: Request, response: Response):
+    request.state.db_wrote = True
+    response.set_cookie(
+        key="recent_write",
+        value="1",
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        max_age=DB_READ_YOUR_WRITES_SECONDS
+    )
+
+# Access token from the Authorization header (API clients) or the cookie (browsers)
+def get_access_token(request: Request):
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return request.cookies.get("access_token")
+
+# Dependency for authenticated user (returns a Principal without touching Postgres)
+async def get_current_user(request: Request, response: Response) -> Principal:
+    if AUTH_MODE == "token":
+        token = get_access_token(request)
+        if not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        try:
+            claims = token_service.decode(token)
+        except TokenError:
+            raise HTTPException(status_code=401, detail="Session expired or invalid")
+        principal = principal_from_record({**claims, "email": claims["sub"]})
+    else:
+        session_id = request.cookies.get("session_id")
+        if not session_id:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        principal, refreshed = await session_store.get(session_id)
+        if not principal:
+            raise HTTPException(status_code=401, detail="Session expired or invalid")
+        if refreshed:
+            # Keep the cookie alive as long as the sliding session
+            set_session_cookie(response, session_id)
+    # Sessions issued under an older permission model must sign in again
+    if principal.permissions_version != PERMISSIONS_VERSION:
         raise HTTPException(status_code=401, detail="Session expired or invalid")
-    # In a real app, parse user_data (e.g., JSON) and return user object
-    return {"email": user_data}
+    return principal
+
+def set_session_cookie(response: Response, session_id: str):
+    response.set_cookie(
+        key="session_id",
+        value=session_id,
+        httponly=True,
+        secure=True,  # Requires HTTPS in production
+        samesite="lax",
+        max_age=SESSION_TTL_SECONDS
+    )
+
+# Sign the client in: a signed access token in token mode, otherwise a Redis session.
+# Returns the access token, if one was issued.
+async def start_session(response: Response, principal: Principal):
+    if AUTH_MODE == "token":
+        claims = principal_record(principal)
+        token, _ = token_service.issue(claims.pop("email"), claims)
+        response.set_cookie(
+            key="access_token",
+            value=token,
+            httponly=True,
+            secure=True,
+            samesite="lax",
+            max_age=ACCESS_TOKEN_TTL_SECONDS
+        )
+        return token
+    session_id = await session_store.create(principal)
+    set_session_cookie(response, session_id)
+    return None
+
+# Opaque keyset cursor: the (created_at, id) of the last row on the page
+def encode_cursor(record):
+    return base64.urlsafe_b64encode(f"{record['created_at'].isoformat()}|{record['id']}".encode()).decode()
+
+def decode_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(record_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Timestamps are stored as naive UTC; accept filters with any offset
+def as_naive_utc(value):
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def keyset_page(records, limit, encode=encode_cursor):
+    # One extra row is fetched to learn whether another page exists
+    items = [dict(record) for record in records[:limit]]
+    next_cursor = encode(records[limit - 1]) if len(records) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+# Search cursor: the (score, id) of the last result; repr keeps the float exact
+def encode_search_cursor(record):
+    return base64.urlsafe_b64encode(f"{record['score']!r}|{record['id']}".encode()).decode()
+
+def decode_search_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        score, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(score), int(record_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Search highlights arrive with matches between chr(2) and chr(3). The text is
+# escaped first, so only our <mark> tags can reach the page. operations and
+# details are stored bleach-escaped and are unescaped first to avoid double escaping.
+def highlight_html(text, stored_escaped=False):
+    if stored_escaped:
+        text = html.unescape(text)
+    return html.escape(text).replace("\x02", "<mark>").replace("\x03", "</mark>")
 
 # Generate a 6-digit OTP
 def generate_otp_code(length=6):
     return ''.join(random.choices(string.digits, k=length))
 
-# Initialize FastAPI-Limiter and database pool on app startup
+# Re-hash a password stored at an outdated bcrypt cost (runs after the login response)
+async def rehash_password(email: str, password: str, old_hash: str):
+    try:
+        new_hash = await hashing_service.hash(password)
+        async with pool_manager.acquire("background") as conn:
+            # Only replace the hash we verified, in case the password changed meanwhile
+            await conn.execute(queries.UPDATE_PASSWORD_HASH, new_hash, email, old_hash)
+        logger.info(f"Re-hashed password at cost {hashing_service.rounds} for: {email}")
+    except (asyncpg.PostgresError, HashingOverloadedError, DatabaseBusyError) as e:
+        logger.warning(f"Password re-hash skipped for {email}: {str(e)}")
+
+# Initialize the rate limiter and database pools on app startup
 @app.on_event("startup")
 async def startup():
-    await init_db_pool()
+    hashing_service.start()
+    if BCRYPT_ROUNDS is not None:
+        hashing_service.rounds = BCRYPT_ROUNDS
+    else:
+        await hashing_service.calibrate(BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS)
+    await init_db_pools()
+    activity_log.start()
+    if SCHEDULER_ENABLED:
+        scheduler.start()
     max_retries = 5
     retry_delay = 2
     for attempt in range(max_retries):
         try:
             await redis_client.ping()
-            await FastAPILimiter.init(redis_client)
+            await limiter_backend.init(redis_client, app)
+            if AUTH_MODE == "token":
+                await token_service.denylist.sync()
+                token_service.denylist.start()
+            else:
+                session_store.start()
             logger.info("Successfully connected to Redis")
             return
         except redis.ConnectionError as e:
@@ -100,22 +341,32 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown():
-    await close_db_pool()
+    await scheduler.stop()
+    # Before the pools close: flushes every queued activity event
+    await activity_log.stop()
+    await token_service.denylist.stop()
+    await session_store.stop()
+    await close_db_pools()
+    hashing_service.shutdown()
 
 # Create Business profile
 @app.post("/Business/", response_model=Business)
-async def create_business_profile(business: UserBusiness, conn=Depends(get_db_conn)):
+async def create_business_profile(business: UserBusiness, request: Request, response: Response, conn=Depends(get_db_conn)):
     try:
         # Insert business
-        result = await conn.fetch(
-            "INSERT INTO Business (company_name, email, phone, hq, operations, website, details) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id, company_name, email",
+        result = await conn.fetchrow(
+            queries.CREATE_BUSINESS,
             business.name, business.email, business.phone, business.hq, business.operations, business.website, business.details
         )
         if not result:
             logger.error("Business creation failed: No record returned")
             raise HTTPException(status_code=400, detail="Business creation failed")
-        new_business = dict(result[0])
+        new_business = dict(result)
+        mark_recent_write(request, response)
         logger.info(f"Created business: {new_business['email']}")
+        await activity_log.record(
+            "business_created", new_business["email"], new_business["id"], request.client.host if request.client else None
+        )
         return new_business
     except asyncpg.UniqueViolationError as e:
         logger.warning(f"Duplicate email: {business.email}")
@@ -124,122 +375,151 @@ async def create_business_profile(business: UserBusiness, conn=Depends(get_db_co
         logger.error(f"Database error in create_business_profile: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error occurred")
 
-# Generate OTP with rate-limiting (5 requests per minute per client IP)
-@app.post("/generate-otp/", response_model=OTPGenerateResponse, dependencies=[Depends(RateLimiter(times=5, seconds=60))])
-async def generate_otp(request: OTPGenerateRequest, conn=Depends(get_db_conn)):
+# List businesses, newest first, with keyset pagination
+@app.get("/Business/", response_model=BusinessPage)
+async def list_businesses(
+    verified: bool = None,
+    created_after: datetime = None,
+    created_before: datetime = None,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Principal = Depends(get_current_user),
+    conn=Depends(get_db_read_conn),
+):
+    query, args = queries.business_page(
+        verified, as_naive_utc(created_after), as_naive_utc(created_before), decode_cursor(cursor), limit + 1
+    )
+    return keyset_page(await conn.fetch(query, *args), limit)
+
+# Ranked full-text and fuzzy name search over businesses
+@app.get("/Business/search/", response_model=BusinessSearchPage)
+async def search_businesses(
+    q: str = Query(..., min_length=2, max_length=200),
+    cursor: str = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(get_current_user),
+    conn=Depends(get_db_read_conn),
+):
+    query, args = queries.business_search(q.strip(), decode_search_cursor(cursor), limit + 1)
+    page = keyset_page(await conn.fetch(query, *args), limit, encode=encode_search_cursor)
+    for item in page["items"]:
+        item["name_highlight"] = highlight_html(item["name_highlight"])
+        item["snippet"] = highlight_html(item["snippet"], stored_escaped=True)
+    return page
+
+# List the users of the caller's own company, newest first
+@app.get("/Business/{business_id}/users", response_model=CompanyUserPage)
+async def list_company_users(
+    business_id: int,
+    created_after: datetime = None,
+    created_before: datetime = None,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Principal = Depends(get_current_user),
+    conn=Depends(get_db_read_conn),
+):
+    if business_id != current_user.company_id:
+        raise HTTPException(status_code=403, detail="Not a member of this business")
+    query, args = queries.company_users_page(
+        business_id, as_naive_utc(created_after), as_naive_utc(created_before), decode_cursor(cursor), limit + 1
+    )
+    return keyset_page(await conn.fetch(query, *args), limit)
+
+# Generate OTP with rate-limiting (5 requests per minute per client IP, 5 per 5 minutes per email)
+@app.post("/generate-otp/", response_model=OTPGenerateResponse, dependencies=[
+    Depends(RateLimiter(Limit(5, seconds=60), Limit(5, minutes=5, identifier=client_email))),
+])
+async def generate_otp(request: OTPGenerateRequest, http_request: Request):
     try:
-        # Check if email exists in Business table
-        result = await conn.fetch("SELECT id FROM Business WHERE email = $1", request.email)
-        if not result:
+        otp = generate_otp_code()
+        expires_at = await otp_store.issue(request.email, otp, prefer_primary=wrote_recently(http_request))
+        if expires_at is None:
             logger.warning(f"Email not found for OTP generation: {request.email}")
             raise HTTPException(status_code=404, detail="Email not associated with a business")
-
-        otp = generate_otp_code()
-        hashed_otp = pwd_context.hash(otp)
-        expires_at = datetime.utcnow() + timedelta(minutes=5)
-
-        # Delete any existing OTP for this email
-        await conn.execute("DELETE FROM otps WHERE email = $1", request.email)
-        # Insert new OTP
-        result = await conn.fetch(
-            "INSERT INTO otps (email, otp, expires_at) VALUES ($1, $2, $3) RETURNING email, expires_at",
-            request.email, hashed_otp, expires_at
-        )
-        if not result:
-            logger.error("OTP generation failed: No record returned")
-            raise HTTPException(status_code=500, detail="Failed to generate OTP")
-        result_dict = dict(result[0])
         logger.info(f"Generated OTP for: {request.email}")
         # Return plain OTP in response (not hashed)
-        return OTPGenerateResponse(email=result_dict["email"], otp=otp, expires_at=result_dict["expires_at"])
+        return OTPGenerateResponse(email=request.email, otp=otp, expires_at=expires_at)
     except asyncpg.PostgresError as e:
         logger.error(f"Database error in generate_otp: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error occurred")
 
-# Verify OTP with rate-limiting (10 requests per minute per client IP)
-@app.post("/verify-otp/", response_model=OTPVerifyResponse, dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def verify_otp(request: OTPVerifyRequest, conn=Depends(get_db_conn), response: Response = None):
+# Verify OTP with rate-limiting (10 requests per minute per client IP and per email)
+@app.post("/verify-otp/", response_model=OTPVerifyResponse, dependencies=[
+    Depends(RateLimiter(Limit(10, seconds=60), Limit(10, seconds=60, identifier=client_email))),
+])
+async def verify_otp(request: OTPVerifyRequest, http_request: Request, response: Response = None):
+    client_ip = http_request.client.host if http_request.client else None
+    await otp_gate.check(request.email, client_ip)
     try:
-        result = await conn.fetch("SELECT otp, expires_at FROM otps WHERE email = $1", request.email)
-        if not result:
-            logger.warning(f"No OTP found for: {request.email}")
-            return OTPVerifyResponse(
-                email=request.email,
-                valid=False,
-                message="No OTP found for this email"
-            )
+        outcome, business_id = await otp_store.consume(request.email, request.otp)
+        if outcome in OTP_FAILURES:
+            log_message, message = OTP_FAILURES[outcome]
+            logger.warning(f"{log_message} for: {request.email}")
+            await otp_gate.record_failure(request.email, client_ip)
+            return OTPVerifyResponse(email=request.email, valid=False, message=message)
 
-        stored_otp = result[0]["otp"]
-        expires_at = result[0]["expires_at"]
-
-        if datetime.utcnow() > expires_at:
-            logger.warning(f"Expired OTP for: {request.email}")
+        mark_recent_write(http_request, response)
+        if outcome == OTP_NO_BUSINESS:
+            logger.warning(f"No business found for: {request.email}")
             return OTPVerifyResponse(
                 email=request.email,
                 valid=False,
-                message="OTP has expired"
+                message="No business found with this email"
             )
 
-        if pwd_context.verify(request.otp, stored_otp):
-            await conn.execute("DELETE FROM otps WHERE email = $1", request.email)
-            result = await conn.fetch("UPDATE Business SET verified = TRUE WHERE email = $1 RETURNING id", request.email)
-            if not result:
-                logger.warning(f"No business found for: {request.email}")
-                return OTPVerifyResponse(
-                    email=request.email,
-                    valid=False,
-                    message="No business found with this email"
-                )
-
-            # Create session
-            session_id = str(uuid.uuid4())
-            await redis_client.setex(f"session:{session_id}", 1800, request.email)  # 30 minutes TTL
-            response.set_cookie(
-                key="session_id",
-                value=session_id,
-                httponly=True,
-                secure=True,  # Requires HTTPS in production
-                samesite="lax",
-                max_age=1800
-            )
-            logger.info(f"OTP verified and session created for: {request.email}")
-            return OTPVerifyResponse(
-                email=request.email,
-                valid=True,
-                message="OTP verified successfully"
-            )
-        else:
-            logger.warning(f"Invalid OTP for: {request.email}")
-            return OTPVerifyResponse(
-                email=request.email,
-                valid=False,
-                message="Invalid OTP"
-            )
+        # Create session; the attempt counter reset shares the Redis round trip
+        access_token, _ = await asyncio.gather(
+            start_session(response, Principal(
+                user_id=None, email=request.email, company_id=business_id,
+                role="business", permissions_version=PERMISSIONS_VERSION
+            )),
+            otp_gate.reset(request.email),
+        )
+        logger.info(f"OTP verified and session created for: {request.email}")
+        await activity_log.record("otp_verified", request.email, business_id, client_ip)
+        return OTPVerifyResponse(
+            email=request.email,
+            valid=True,
+            message="OTP verified successfully",
+            access_token=access_token
+        )
     except asyncpg.PostgresError as e:
         logger.error(f"Database error in verify_otp: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error occurred")
 
 # Login endpoint
 @app.post("/login/")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), conn=Depends(get_db_conn), response: Response = None):
+async def login(request: Request, background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends(), response: Response = None):
+    client_ip = request.client.host if request.client else None
+    # Gate first: locked-out requests never take a pool connection
+    await login_gate.check(form_data.username, client_ip)
     try:
-        result = await conn.fetch("SELECT email, password FROM users WHERE email = $1", form_data.username)
-        if not result or not pwd_context.verify(form_data.password, result[0]["password"]):
+        # The connection is held only for the lookup, not during bcrypt
+        async with pool_manager.acquire() as conn:
+            result = await conn.fetchrow(queries.USER_CREDENTIALS, form_data.username)
+        if not result:
+            logger.warning(f"Invalid login attempt for: {form_data.username}")
+            await login_gate.record_failure(form_data.username, client_ip)
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        stored_hash = result["password"]
+        valid, needs_update = await hashing_service.verify_and_check(form_data.password, stored_hash)
+        if not valid:
             logger.warning(f"Invalid login attempt for: {form_data.username}")
+            await login_gate.record_failure(form_data.username, client_ip)
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        
+        await login_gate.reset(form_data.username)
+        if needs_update:
+            background_tasks.add_task(rehash_password, form_data.username, form_data.password, stored_hash)
+
         # Create session
-        session_id = str(uuid.uuid4())
-        await redis_client.setex(f"session:{session_id}", 1800, form_data.username)
-        response.set_cookie(
-            key="session_id",
-            value=session_id,
-            httponly=True,
-            secure=True,
-            samesite="lax",
-            max_age=1800
-        )
+        access_token = await start_session(response, Principal(
+            user_id=result["id"], email=result["email"], company_id=result["company_id"],
+            role=result["role"], permissions_version=PERMISSIONS_VERSION
+        ))
         logger.info(f"User logged in: {form_data.username}")
+        await activity_log.record("user_logged_in", result["email"], result["company_id"], client_ip)
+        if access_token:
+            return {"message": "Login successful", "access_token": access_token, "token_type": "bearer"}
         return {"message": "Login successful"}
     except asyncpg.PostgresError as e:
         logger.error(f"Database error in login: {str(e)}")
@@ -247,33 +527,185 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), conn=Depends(g
 
 # Create User
 @app.post("/users/", response_model=User)
-async def create_user(user: UserCreate, conn=Depends(get_db_conn)):
+async def create_user(user: UserCreate, request: Request, response: Response):
     try:
-        # Verify company_id exists
-        result = await conn.fetch("SELECT id FROM Business WHERE id = $1", user.company_id)
-        if not result:
-            logger.warning(f"Invalid company_id: {user.company_id}")
-            raise HTTPException(status_code=400, detail="Invalid company ID")
-
-        hashed_password = pwd_context.hash(user.password)
-        result = await conn.fetch(
-            "INSERT INTO users (name, email, phone, password, role, company_id) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id, name, email",
-            user.name, user.email, user.phone, hashed_password, user.role, user.company_id
-        )
+        # Hash in the worker pool before taking a connection, so the connection
+        # is held only for the INSERT; the company_id FK validates the company
+        hashed_password = await hashing_service.hash(user.password)
+        async with pool_manager.acquire() as conn:
+            result = await conn.fetchrow(
+                queries.CREATE_USER,
+                user.name, user.email, user.phone, hashed_password, user.role, user.company_id
+            )
         if not result:
             logger.error("User creation failed: No record returned")
             raise HTTPException(status_code=400, detail="User creation failed")
-        new_user = dict(result[0])
+        new_user = dict(result)
+        mark_recent_write(request, response)
         logger.info(f"Created user: {new_user['email']}")
+        await activity_log.record(
+            "user_created", new_user["email"], user.company_id, request.client.host if request.client else None,
+            user_id=new_user["id"], role=user.role
+        )
         return new_user
     except asyncpg.UniqueViolationError as e:
         logger.warning(f"Duplicate email: {user.email}")
         raise HTTPException(status_code=400, detail="Email already exists")
+    except asyncpg.ForeignKeyViolationError as e:
+        logger.warning(f"Invalid company_id: {user.company_id}")
+        raise HTTPException(status_code=400, detail="Invalid company ID")
     except asyncpg.PostgresError as e:
         logger.error(f"Database error in create_user: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error occurred")
     
 # Protected profile endpoint
 @app.get("/profile/")
-async def get_profile(current_user=Depends(get_current_user)):
-    return {"email": current_user["email"], "message": "Authenticated user profile"}
\ No newline at end of file
+async def get_profile(current_user: Principal = Depends(get_current_user)):
+    return {
+        "id": current_user.user_id,
+        "email": current_user.email,
+        "company_id": current_user.company_id,
+        "role": current_user.role,
+        "message": "Authenticated user profile"
+    }
+
+# Logout: revoke the access token or delete the Redis session
+@app.post("/logout/")
+async def logout(request: Request, response: Response, current_user: Principal = Depends(get_current_user)):
+    if AUTH_MODE == "token":
+        await token_service.revoke(token_service.decode(get_access_token(request)))
+        response.delete_cookie("access_token")
+    else:
+        await session_store.delete(request.cookies.get("session_id"), current_user.email)
+        response.delete_cookie("session_id")
+    logger.info(f"User logged out: {current_user.email}")
+    await activity_log.record(
+        "user_logged_out", current_user.email, current_user.company_id, request.client.host if request.client else None
+    )
+    return {"message": "Logout successful"}
+
+# List the current user's active sessions
+@app.get("/sessions/")
+async def list_sessions(request: Request, current_user: Principal = Depends(get_current_user)):
+    if AUTH_MODE == "token":
+        raise HTTPException(status_code=400, detail="Sessions are not used in token mode")
+    current_session = request.cookies.get("session_id")
+    sessions = await session_store.list_for_user(current_user.email)
+    return {
+        "sessions": [
+            {"id": session_handle(session_id), "expires_in": ttl, "current": session_id == current_session}
+            for session_id, ttl in sessions
+        ]
+    }
+
+# Revoke all of the current user's sessions, on every device
+@app.delete("/sessions/")
+async def revoke_sessions(request: Request, response: Response, current_user: Principal = Depends(get_current_user)):
+    if AUTH_MODE == "token":
+        raise HTTPException(status_code=400, detail="Sessions are not used in token mode")
+    revoked = await session_store.delete_all_for_user(current_user.email)
+    response.delete_cookie("session_id")
+    logger.info(f"Revoked {revoked} sessions for: {current_user.email}")
+    await activity_log.record(
+        "sessions_revoked", current_user.email, current_user.company_id,
+        request.client.host if request.client else None, revoked=revoked
+    )
+    return {"message": "All sessions revoked", "revoked": revoked}
+
+# Bulk import of businesses or users from a streamed CSV or NDJSON body
+@app.post("/import/{kind}/", dependencies=[Depends(RateLimiter(times=5, minutes=1))])
+async def bulk_import(kind: str, request: Request, format: str = None, current_user: Principal = Depends(get_current_user)):
+    if kind not in IMPORT_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown import kind")
+    fmt = format or import_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson")
+    report = ImportReport(kind, fmt, owner=current_user.email)
+    logger.info(f"Bulk import {report.id} of {kind} started by: {current_user.email}")
+    try:
+        await BulkImporter(kind, hashing_service, company_id=current_user.company_id).run(request.stream(), fmt, report)
+    except ImportFormatError as e:
+        logger.warning(f"Bulk import {report.id} stopped: {str(e)}")
+        raise HTTPException(status_code=400, detail={"message": str(e), "report": report.as_dict()})
+    await activity_log.record(
+        "bulk_import", current_user.email, current_user.company_id, request.client.host if request.client else None,
+        kind=kind, rows=report.rows, inserted=report.inserted, rejected=report.invalid + report.conflicts
+    )
+    return report.as_dict()
+
+# Progress of this caller's imports still running in this worker
+@app.get("/import/")
+async def list_imports(current_user: Principal = Depends(get_current_user)):
+    return {"imports": [
+        report.as_dict() for report in list(imports_in_progress.values()) if report.owner == current_user.email
+    ]}
+
+# Accept-Encoding with q-values: "gzip;q=0" refuses gzip, and "*" covers it
+# only when gzip is not listed itself
+def accepts_gzip(accept_encoding):
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip()] = quality
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+# Streaming export of businesses or of the caller's company users (NDJSON or CSV)
+@app.get("/export/{kind}/", dependencies=[Depends(RateLimiter(times=10, minutes=1))])
+async def export(kind: str, request: Request, format: str = "ndjson", columns: str = None,
+                 current_user: Principal = Depends(get_current_user)):
+    if kind not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Unknown export kind")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    try:
+        selected = export_columns(kind, columns)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    compress = accepts_gzip(request.headers.get("accept-encoding", ""))
+    company_id = current_user.company_id if kind == "users" else None
+    # Long-running reads stay off the request pool: replica if healthy, else the export pool
+    pool = "replica" if replica_monitor.route() == "replica" else "export"
+    headers = {"Content-Disposition": f'attachment; filename="{kind}.{format}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    chunks, close = await open_export(kind, format, selected, company_id=company_id, compress=compress, pool=pool)
+    logger.info(f"Export of {kind} as {format} started by: {current_user.email}")
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[format],
+        headers=headers,
+        background=BackgroundTask(close),
+    )
+
+# Metrics expose pool state and raw database errors: scrapers only, with the shared token
+def require_metrics_token(request: Request):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else ""
+    if not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+# Runtime metrics
+@app.get("/metrics/", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    return {
+        "hashing": hashing_service.stats(),
+        "db_pools": pool_metrics(),
+        "session_cache": session_store.cache.stats(),
+        "session_refreshes": session_store.refreshes,
+        "rate_limiter": limiter_backend.stats(),
+        "scheduler": scheduler.metrics(),
+        "activity_log": activity_log.stats(),
+    }
@@ -0,0 +1,46 @@
+import hashlib
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Digests look like "$otp-hmac$<version>$<hex>"; anything else is a legacy bcrypt hash
+OTP_DIGEST_PREFIX = "$otp-hmac$"
+
+
+class OtpHasher:
+    def __init__(self, peppers, legacy_verify=None):
+        if not peppers:
+            raise ValueError("At least one OTP pepper is required")
+        self.current_version = peppers[0][0]
+        self._peppers = {version: secret.encode() for version, secret in peppers}
+        # Coroutine used for rows written before the HMAC rollout (bcrypt)
+        self._legacy_verify = legacy_verify
+
+    def _digest(self, version, email, otp):
+        # Bind the code to the email so a digest cannot be replayed against another row
+        message = f"{email.lower()}:{otp}".encode()
+        return hmac.new(self._peppers[version], message, hashlib.sha256).hexdigest()
+
+    def hash(self, email, otp):
+        digest = self._digest(self.current_version, email, otp)
+        return f"{OTP_DIGEST_PREFIX}{self.current_version}${digest}"
+
+    def candidates(self, email, otp):
+        # The digest under every configured pepper, current first, for stores
+        # that compare digests themselves
+        return [f"{OTP_DIGEST_PREFIX}{version}${self._digest(version, email, otp)}" for version in self._peppers]
+
+    def is_legacy(self, stored):
+        return not stored.startswith(OTP_DIGEST_PREFIX)
+
+    async def verify(self, email, otp, stored):
+        if self.is_legacy(stored):
+            if self._legacy_verify is None:
+                return False
+            return await self._legacy_verify(otp, stored)
+        version, sep, digest = stored[len(OTP_DIGEST_PREFIX):].partition("$")
+        if not sep or version not in self._peppers:
+            logger.warning(f"OTP digest signed with unknown pepper version: {version}")
+            return False
+        return hmac.compare_digest(self._digest(version, email, otp), digest)
@@ -0,0 +1,138 @@
+from abc import ABC, abstractmethod
+from app import queries
+from app.database import pool_manager, replica_monitor
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of OtpStore.consume
+OTP_VERIFIED = "verified"
+OTP_MISSING = "missing"
+OTP_EXPIRED = "expired"
+OTP_INVALID = "invalid"
+OTP_NO_BUSINESS = "no_business"
+
+# Deletes KEYS[1] only if it holds one of ARGV (the digest under each pepper):
+# an atomic get-and-delete that a wrong guess cannot burn.
+# Returns 1 when consumed, 0 when there is no OTP, -1 on a mismatch.
+CONSUME_SCRIPT = """
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+    return 0
+end
+for i = 1, #ARGV do
+    if stored == ARGV[i] then
+        redis.call('DEL', KEYS[1])
+        return 1
+    end
+end
+return -1
+"""
+
+
+class OtpStore(ABC):
+    # issue(email, otp) -> expires_at, or None when the email has no business;
+    # prefer_primary skips the replica for clients that have just written
+    # consume(email, otp) -> (outcome, business_id); on OTP_VERIFIED the
+    # business has been marked verified
+    @abstractmethod
+    async def issue(self, email, otp, prefer_primary=False):
+        ...
+
+    @abstractmethod
+    async def consume(self, email, otp):
+        ...
+
+
+class PostgresOtpStore(OtpStore):
+    # Rows in the otps table; issue and consume are one statement each on the primary
+    def __init__(self, hasher, ttl_seconds):
+        self.hasher = hasher
+        self.ttl_seconds = ttl_seconds
+
+    async def issue(self, email, otp, prefer_primary=False):
+        # Always on the primary: the statement inserts the OTP row
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        async with pool_manager.acquire() as conn:
+            result = await conn.fetchrow(queries.ISSUE_OTP, email, self.hasher.hash(email, otp), expires_at)
+        return result["expires_at"] if result else None
+
+    async def consume(self, email, otp):
+        outcome = OTP_VERIFIED
+        async with pool_manager.acquire() as conn:
+            # Fast path: the digest is deterministic, so matching, expiry, deletion
+            # and business activation all happen in one statement
+            result = await conn.fetchrow(queries.CONSUME_OTP, email, self.hasher.hash(email, otp))
+            if not result["consumed"]:
+                # Slow path: explain the failure, and accept rows hashed with an
+                # older pepper or legacy bcrypt by consuming the stored digest itself
+                stored = await conn.fetchrow(queries.OTP_BY_EMAIL, email)
+                if not stored:
+                    outcome = OTP_MISSING
+                elif datetime.utcnow() > stored["expires_at"]:
+                    outcome = OTP_EXPIRED
+                elif not await self.hasher.verify(email, otp, stored["otp"]):
+                    outcome = OTP_INVALID
+                else:
+                    result = await conn.fetchrow(queries.CONSUME_OTP, email, stored["otp"])
+                    if not result["consumed"]:
+                        outcome = OTP_INVALID
+        if outcome != OTP_VERIFIED:
+            return outcome, None
+        if result["business_id"] is None:
+            return OTP_NO_BUSINESS, None
+        return OTP_VERIFIED, result["business_id"]
+
+
+class RedisOtpStore(OtpStore):
+    # Redis keys that expire on their own, so nothing needs purging. Postgres
+    # is read (replica when healthy) to check the business on issue, and
+    # written only once an OTP is verified, to activate the business.
+    def __init__(self, redis_client, hasher, ttl_seconds, prefix="otp:"):
+        self.redis = redis_client
+        self.hasher = hasher
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._consume = redis_client.register_script(CONSUME_SCRIPT)
+
+    def _key(self, email):
+        return f"{self.prefix}{email.lower()}"
+
+    async def issue(self, email, otp, prefer_primary=False):
+        # A business created moments ago may not have reached the replica yet
+        async with pool_manager.acquire(replica_monitor.route(prefer_primary)) as conn:
+            business_id = await conn.fetchval(queries.BUSINESS_ID_BY_EMAIL, email)
+        if business_id is None:
+            return None
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        await self.redis.set(self._key(email), self.hasher.hash(email, otp), ex=self.ttl_seconds)
+        return expires_at
+
+    async def consume(self, email, otp):
+        # Expired keys are gone, so an expired OTP reports as missing
+        consumed = await self._consume(keys=[self._key(email)], args=self.hasher.candidates(email, otp))
+        if consumed == 0:
+            return OTP_MISSING, None
+        if consumed < 0:
+            return OTP_INVALID, None
+        async with pool_manager.acquire() as conn:
+            business_id = await conn.fetchval(queries.MARK_BUSINESS_VERIFIED, email)
+        if business_id is None:
+            return OTP_NO_BUSINESS, None
+        return OTP_VERIFIED, business_id
+
+
+async def purge_expired_otps(batch_size):
+    # Maintenance job: short batches keep each transaction and its locks small.
+    # Returns the number of rows deleted.
+    deleted = 0
+    while True:
+        async with pool_manager.acquire("background") as conn:
+            status = await conn.execute(queries.PURGE_EXPIRED_OTPS, batch_size)
+        count = int(status.split()[-1])
+        deleted += count
+        if count < batch_size:
+            return deleted
+        await asyncio.sleep(0)
@@ -0,0 +1,150 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Named SQL statements used by the API. Call sites pass these constants to the
+# matching fetchrow/fetchval/execute call, so every connection sees identical
+# query text and asyncpg's per-connection statement cache reuses one parse and
+# plan per statement.
+
+# Business
+CREATE_BUSINESS = (
+    "INSERT INTO Business (company_name, email, phone, hq, operations, website, details) "
+    "VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id, company_name, email"
+)
+BUSINESS_ID_BY_EMAIL = "SELECT id FROM Business WHERE email = $1"
+MARK_BUSINESS_VERIFIED = "UPDATE Business SET verified = TRUE WHERE email = $1 RETURNING id"
+
+# OTPs
+# Issues (or replaces) the OTP for a registered business email in one statement;
+# returns no row when the email has no business. ON CONFLICT on unique_email
+# makes concurrent requests for the same email serialize instead of failing.
+ISSUE_OTP = (
+    "WITH business AS (SELECT email FROM Business WHERE email = $1) "
+    "INSERT INTO otps (email, otp, expires_at) SELECT email, $2, $3 FROM business "
+    "ON CONFLICT (email) DO UPDATE "
+    "SET otp = EXCLUDED.otp, expires_at = EXCLUDED.expires_at, created_at = CURRENT_TIMESTAMP "
+    "RETURNING email, expires_at"
+)
+OTP_BY_EMAIL = "SELECT otp, expires_at FROM otps WHERE email = $1"
+# Consumes an unexpired OTP whose stored digest is $2 and marks the business
+# verified, atomically. consumed is false when nothing matched; business_id is
+# NULL when the OTP was consumed but no business has that email.
+CONSUME_OTP = (
+    "WITH consumed AS ("
+    "DELETE FROM otps WHERE email = $1 AND otp = $2 AND expires_at > (now() AT TIME ZONE 'UTC') "
+    "RETURNING email"
+    "), activated AS ("
+    "UPDATE Business SET verified = TRUE WHERE email IN (SELECT email FROM consumed) RETURNING id"
+    ") "
+    "SELECT EXISTS (SELECT 1 FROM consumed) AS consumed, (SELECT id FROM activated) AS business_id"
+)
+# Deletes up to $1 expired OTPs, oldest first, via the expires_at index; rows
+# locked by a concurrent verify are skipped rather than waited on
+PURGE_EXPIRED_OTPS = (
+    "WITH expired AS ("
+    "SELECT id FROM otps WHERE expires_at < (now() AT TIME ZONE 'UTC') "
+    "ORDER BY expires_at LIMIT $1 FOR UPDATE SKIP LOCKED"
+    ") "
+    "DELETE FROM otps WHERE id IN (SELECT id FROM expired)"
+)
+
+# Users
+CREATE_USER = (
+    "INSERT INTO users (name, email, phone, password, role, company_id) "
+    "VALUES ($1, $2, $3, $4, $5, $6) RETURNING id, name, email"
+)
+USER_CREDENTIALS = "SELECT id, email, password, role, company_id FROM users WHERE email = $1"
+UPDATE_PASSWORD_HASH = "UPDATE users SET password = $1 WHERE email = $2 AND password = $3"
+
+# Keyset pages, newest first. Filters are spliced from fixed fragments, so each
+# combination is its own cached statement, and verified is written as a literal
+# so the planner can use the partial index for verified businesses.
+def _keyset_page(select, conditions, args, created_after, created_before, after, limit):
+    conditions = list(conditions)
+    args = list(args)
+    if created_after is not None:
+        args.append(created_after)
+        conditions.append(f"created_at >= ${len(args)}")
+    if created_before is not None:
+        args.append(created_before)
+        conditions.append(f"created_at < ${len(args)}")
+    if after is not None:
+        # Row comparison matches the (created_at DESC, id DESC) index order
+        args.extend(after)
+        conditions.append(f"(created_at, id) < (${len(args) - 1}, ${len(args)})")
+    args.append(limit)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{select}{where} ORDER BY created_at DESC, id DESC LIMIT ${len(args)}", args
+
+
+def business_page(verified=None, created_after=None, created_before=None, after=None, limit=50):
+    conditions = []
+    if verified is not None:
+        conditions.append("verified" if verified else "NOT verified")
+    return _keyset_page(
+        "SELECT id, company_name, email, verified, created_at FROM Business",
+        conditions, [], created_after, created_before, after, limit
+    )
+
+
+def company_users_page(company_id, created_after=None, created_before=None, after=None, limit=50):
+    return _keyset_page(
+        "SELECT id, name, email, role, created_at FROM users",
+        ["company_id = $1"], [company_id], created_after, created_before, after, limit
+    )
+
+
+# Ranked business search: full-text matches on the weighted search_vector, or
+# fuzzy name matches through the trigram index (word similarity above
+# pg_trgm.word_similarity_threshold). Headlines are built for the page only.
+def business_search(text, after=None, limit=20):
+    args = [text]
+    keyset = ""
+    if after is not None:
+        args.extend(after)
+        keyset = "WHERE (score, id) < ($2::real, $3) "
+    args.append(limit)
+    return (
+        "WITH matches AS ("
+        "SELECT id, company_name, email, operations, details, verified, query, "
+        "ts_rank_cd(search_vector, query) + word_similarity($1, coalesce(company_name, '')) AS score "
+        "FROM Business, websearch_to_tsquery('english', $1) AS query "
+        "WHERE search_vector @@ query OR $1 <% company_name"
+        "), page AS ("
+        f"SELECT * FROM matches {keyset}ORDER BY score DESC, id DESC LIMIT ${len(args)}"
+        ") "
+        # Matches are delimited by chr(2)/chr(3), not tags: the caller escapes
+        # the text and only then turns the delimiters into <mark>
+        "SELECT id, company_name, email, verified, score, "
+        "ts_headline('english', translate(coalesce(company_name, ''), chr(2) || chr(3), ''), query, "
+        "'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', HighlightAll=true') AS name_highlight, "
+        "ts_headline('english', translate(concat_ws(' ', operations, details), chr(2) || chr(3), ''), query, "
+        "'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxFragments=2, MinWords=5, MaxWords=20') AS snippet "
+        "FROM page ORDER BY score DESC, id DESC"
+    ), args
+
+
+STATEMENTS = {
+    name: value for name, value in globals().items()
+    if name.isupper() and isinstance(value, str)
+}
+
+
+# Distinct statements the API can send through asyncpg's statement cache: the
+# named ones, every business_page (3 verified states x 8 range/keyset) and
+# company_users_page (8) filter combination, and business_search with and
+# without a keyset. Exports use uncached statements and are not counted.
+CACHED_STATEMENT_COUNT = len(STATEMENTS) + 3 * 8 + 8 + 2
+
+
+async def check_statements(conn):
+    # Run once at startup: parse every named statement so schema drift stops
+    # the app from booting rather than failing the first request. conn.prepare()
+    # bypasses the statement cache, so nothing here is reused by later queries.
+    for name, query in STATEMENTS.items():
+        try:
+            await conn.prepare(query)
+        except Exception as e:
+            logger.error(f"Failed to prepare statement {name}: {str(e)}")
+            raise
@@ -0,0 +1,273 @@
+from fastapi import HTTPException, Request, status
+from fastapi.routing import APIRoute
+from app.config import RATE_LIMIT_LEASE_SIZE, RATE_LIMIT_LEASE_SECONDS, RATE_LIMIT_LOCAL_KEYS, RATE_LIMIT_MIN_LEASED_LIMIT
+from collections import OrderedDict
+from redis.exceptions import NoScriptError
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# GCRA (generic cell rate algorithm), all or nothing over several keys. Each
+# KEYS[i] holds a theoretical arrival time in ms and has four ARGV entries:
+# period in ms, limit, tokens requested, and unused tokens from an expired
+# lease to give back first. If any key has no token left nothing is granted on
+# any key (refunds still apply). Returns a {granted, extra} pair per key:
+# extra is the tokens still available, or when denied the ms until that key
+# has a token again (0 for keys that were not the problem).
+LIMIT_SCRIPT = """
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local state = {}
+local denied = false
+for i, key in ipairs(KEYS) do
+    local base = (i - 1) * 4
+    local period = tonumber(ARGV[base + 1])
+    local interval = period / tonumber(ARGV[base + 2])
+    local refund = tonumber(ARGV[base + 4])
+    local tat = tonumber(redis.call('GET', key) or now) - refund * interval
+    if tat < now then
+        tat = now
+    end
+    local available = math.floor((period - (tat - now)) / interval + 1e-9)
+    local wait = 0
+    if available < 1 then
+        denied = true
+        wait = math.ceil(tat + interval - period - now)
+    end
+    state[i] = {tat, interval, available, tonumber(ARGV[base + 3]), refund, wait}
+end
+local result = {}
+for i, key in ipairs(KEYS) do
+    local tat, interval, available = state[i][1], state[i][2], state[i][3]
+    local granted = 0
+    if not denied then
+        granted = math.min(state[i][4], available)
+        tat = tat + granted * interval
+    end
+    if granted > 0 or state[i][5] > 0 then
+        if tat > now then
+            redis.call('SET', key, tostring(tat), 'PX', math.ceil(tat - now))
+        else
+            redis.call('DEL', key)
+        end
+    end
+    result[2 * i - 1] = granted
+    result[2 * i] = denied and state[i][6] or available - granted
+end
+return result
+"""
+
+
+async def client_ip(request: Request):
+    return request.client.host if request.client else "unknown"
+
+
+async def client_email(request: Request):
+    # For JSON bodies with an "email" field (OTP endpoints); FastAPI caches the body
+    try:
+        email = (await request.json()).get("email")
+    except (ValueError, AttributeError):
+        email = None
+    return email.strip().lower() if isinstance(email, str) else "invalid"
+
+
+class _Lease:
+    # Tokens this worker has already reserved in Redis for one key
+    __slots__ = ("tokens", "expires", "remaining", "blocked_until")
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires = 0.0
+        # Tokens Redis still had after the last grant; None until we have asked once
+        self.remaining = None
+        self.blocked_until = 0.0
+
+
+class RateLimiterBackend:
+    # Two tiers: a per-worker lease of tokens answers most requests locally,
+    # and Redis (GCRA) is asked only to refill the lease. Leases shrink to a
+    # single token as the client nears its limit, so decisions close to the
+    # limit are made in Redis. Leased tokens still unused after lease_seconds
+    # are given back with the next refill, so workers never over-admit and
+    # under-admit only while a lease is live. Leasing is meant for high limits:
+    # limits below min_leased_limit (by default every limit in this app) never
+    # lease, and each request makes one Redis call for all of its keys.
+    def __init__(self, prefix="ratelimit", lease_size=10, lease_seconds=1.0, max_local_keys=10000,
+                 min_leased_limit=100):
+        self.prefix = prefix
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.min_leased_limit = min_leased_limit
+        self.max_local_keys = max_local_keys
+        self.redis = None
+        self.sha = None
+        self._reload_lock = asyncio.Lock()
+        self._leases = OrderedDict()
+        self.script_reloads = 0
+        self.rejected = 0
+        self.local_decisions = 0
+        self.redis_calls = 0
+        self.refunded = 0
+
+    async def init(self, redis_client, app):
+        self.redis = redis_client
+        self.sha = await redis_client.script_load(LIMIT_SCRIPT)
+        self.bind_routes(app)
+
+    def bind_routes(self, app):
+        # Resolve every limiter's route key once, instead of walking app.routes per request
+        bound = 0
+        for route in app.routes:
+            if not isinstance(route, APIRoute):
+                continue
+            methods = ",".join(sorted(route.methods))
+            for index, dependency in enumerate(route.dependencies):
+                limiter = dependency.dependency
+                if isinstance(limiter, RateLimiter) and limiter.route_key is None:
+                    limiter.route_key = f"{methods}:{route.path}:{index}"
+                    bound += 1
+        logger.info(f"Rate limiter bound to {bound} route dependencies")
+
+    async def _load_script(self, failed_sha):
+        # Single-flight reload after a SCRIPT FLUSH or Redis restart: the first
+        # coroutine reloads, the rest wait on the lock and reuse the new SHA
+        async with self._reload_lock:
+            if self.sha == failed_sha:
+                self.sha = await self.redis.script_load(LIMIT_SCRIPT)
+                self.script_reloads += 1
+                logger.warning("Rate limit script reloaded into Redis")
+
+    async def _reserve(self, keys, args):
+        # One script call for every key; returns a (granted, extra) pair per key
+        self.redis_calls += 1
+        sha = self.sha
+        try:
+            result = await self.redis.evalsha(sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await self._load_script(sha)
+            result = await self.redis.evalsha(self.sha, len(keys), *keys, *args)
+        return list(zip(result[::2], result[1::2]))
+
+    def _lease(self, key):
+        lease = self._leases.get(key)
+        if lease is None:
+            lease = self._leases[key] = _Lease()
+            while len(self._leases) > self.max_local_keys:
+                self._leases.popitem(last=False)
+        else:
+            self._leases.move_to_end(key)
+        return lease
+
+    async def acquire(self, checks):
+        # checks: (key, limit, period_ms) per limit on the request; a token is
+        # taken from every key or from none. Returns 0 if the request is
+        # allowed, otherwise milliseconds to wait.
+        now = time.monotonic()
+        leases = [self._lease(key) for key, _, _ in checks]
+        blocked_until = max(lease.blocked_until for lease in leases)
+        if blocked_until > now:
+            self.local_decisions += 1
+            return math.ceil((blocked_until - now) * 1000)
+        local, missing = [], []
+        for check, lease in zip(checks, leases):
+            (local if lease.tokens > 0 and lease.expires > now else missing).append((check, lease))
+        # Taken before awaiting Redis so concurrent requests cannot spend them
+        # too; given back below if Redis denies the request
+        for _, lease in local:
+            lease.tokens -= 1
+        if not missing:
+            self.local_decisions += 1
+            return 0
+        keys, args = [], []
+        for (key, limit, period_ms), lease in missing:
+            # Whatever is left of an expired lease goes back to Redis with this call
+            refund = max(lease.tokens, 0)
+            lease.tokens = 0
+            self.refunded += refund
+            if lease.remaining is None or limit < self.min_leased_limit:
+                requested = 1
+            else:
+                requested = max(1, min(self.lease_size, lease.remaining // 2))
+            keys.append(key)
+            args.extend((period_ms, limit, requested, refund))
+        results = await self._reserve(keys, args)
+        if not all(granted for granted, _ in results):
+            for _, lease in local:
+                lease.tokens += 1
+            wait = 1
+            for (_, lease), (_, extra) in zip(missing, results):
+                if extra:
+                    lease.remaining = 0
+                    lease.blocked_until = now + extra / 1000
+                    wait = max(wait, extra)
+            return wait
+        for (_, lease), (granted, extra) in zip(missing, results):
+            # Added, not assigned: a concurrent refill for the same key keeps its tokens
+            lease.tokens += granted - 1
+            lease.remaining = extra
+            lease.expires = now + self.lease_seconds
+        return 0
+
+    def stats(self):
+        return {
+            "rejected": self.rejected,
+            "local_decisions": self.local_decisions,
+            "redis_calls": self.redis_calls,
+            "refunded": self.refunded,
+            "leased_keys": len(self._leases),
+            "script_reloads": self.script_reloads,
+        }
+
+
+limiter_backend = RateLimiterBackend(
+    lease_size=RATE_LIMIT_LEASE_SIZE,
+    lease_seconds=RATE_LIMIT_LEASE_SECONDS,
+    max_local_keys=RATE_LIMIT_LOCAL_KEYS,
+    min_leased_limit=RATE_LIMIT_MIN_LEASED_LIMIT,
+)
+
+
+class Limit:
+    # One limit of a RateLimiter: times per seconds + minutes, per identifier
+    def __init__(self, times, seconds=0, minutes=0, identifier=None):
+        self.times = times
+        self.milliseconds = 1000 * seconds + 60000 * minutes
+        self.identifier = identifier or client_ip
+
+
+class RateLimiter:
+    # Route dependency: Depends(RateLimiter(times=5, seconds=60)), or several
+    # limits checked together in one Redis call:
+    # Depends(RateLimiter(Limit(5, seconds=60), Limit(5, minutes=5, identifier=client_email)))
+    def __init__(self, *limits, times=None, seconds=0, minutes=0, identifier=None, backend=limiter_backend):
+        if times is not None:
+            limits = (Limit(times, seconds, minutes, identifier),) + limits
+        if not limits:
+            raise ValueError("RateLimiter needs at least one limit")
+        self.limits = limits
+        self.backend = backend
+        # Set once at startup by RateLimiterBackend.bind_routes
+        self.route_key = None
+
+    async def __call__(self, request: Request):
+        route_key = self.route_key
+        if route_key is None:
+            # Not bound (e.g. route added after startup): the matched route is in the scope
+            route_key = f"{request.method}:{request.scope['route'].path}"
+        checks = []
+        for index, limit in enumerate(self.limits):
+            identity = await limit.identifier(request)
+            # The index keeps two limits on the same identifier apart
+            key = f"{self.backend.prefix}:{route_key}:{index}:{identity}"
+            checks.append((key, limit.times, limit.milliseconds))
+        pexpire = await self.backend.acquire(checks)
+        if pexpire != 0:
+            self.backend.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": str(math.ceil(pexpire / 1000))}
+            )
@@ -0,0 +1,125 @@
+import asyncio
+import asyncpg
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, name, interval_seconds, func):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        # Coroutine function; its return value (e.g. rows purged) is kept as last_result
+        self.func = func
+        self.next_run = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = None
+        self.last_result = None
+        self.last_error = None
+
+    def snapshot(self):
+        return {
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_ms": round(self.last_seconds * 1000, 3) if self.last_seconds is not None else None,
+            "avg_ms": round(self.total_seconds / self.runs * 1000, 3) if self.runs else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    # Runs registered jobs on fixed intervals in exactly one worker across all
+    # processes and hosts. Leadership is a session-level Postgres advisory lock
+    # held on a dedicated connection: if the leader dies or its connection
+    # drops, Postgres releases the lock and another worker takes over at its
+    # next election attempt.
+    def __init__(self, dsn, lock_id, election_seconds, tick_seconds=1.0):
+        self.dsn = dsn
+        self.lock_id = lock_id
+        self.election_seconds = election_seconds
+        self.tick_seconds = tick_seconds
+        self.jobs = []
+        self.leader = False
+        self.elections_won = 0
+        self._task = None
+
+    def register(self, name, interval_seconds, func):
+        self.jobs.append(Job(name, interval_seconds, func))
+
+    async def _run_job(self, job):
+        started = time.perf_counter()
+        try:
+            job.last_result = await job.func()
+            job.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.warning(f"Scheduled job {job.name} failed: {str(e)}")
+        elapsed = time.perf_counter() - started
+        job.runs += 1
+        job.last_seconds = elapsed
+        job.total_seconds += elapsed
+        job.max_seconds = max(job.max_seconds, elapsed)
+        job.next_run = time.monotonic() + job.interval_seconds
+
+    async def _lead(self):
+        # Returns when the lock cannot be taken; raises when the lock connection fails
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_id):
+                return
+            self.leader = True
+            self.elections_won += 1
+            logger.info(f"Scheduler leadership acquired (lock {self.lock_id})")
+            while True:
+                for job in self.jobs:
+                    if job.next_run <= time.monotonic():
+                        await self._run_job(job)
+                # The lock lives as long as this session, so a live session means we still lead
+                await conn.fetchval("SELECT 1")
+                await asyncio.sleep(self.tick_seconds)
+        finally:
+            if self.leader:
+                logger.info("Scheduler leadership released")
+            self.leader = False
+            # Ending the session releases the advisory lock
+            conn.terminate()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._lead()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Scheduler election failed: {str(e)}")
+            await asyncio.sleep(self.election_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self):
+        return {
+            "leader": self.leader,
+            "elections_won": self.elections_won,
+            "jobs": {job.name: job.snapshot() for job in self.jobs},
+        }
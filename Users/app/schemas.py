@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, validator
 from datetime import datetime
+from typing import List, Optional
 import re
 import bleach
 
@@ -35,6 +36,31 @@ class Business(BaseModel):
     company_name: str
     email: EmailStr
 
+class BusinessSummary(BaseModel):
+    id: int
+    company_name: Optional[str]
+    email: EmailStr
+    verified: bool
+    created_at: datetime
+
+class BusinessPage(BaseModel):
+    items: List[BusinessSummary]
+    next_cursor: Optional[str] = None
+
+class BusinessSearchResult(BaseModel):
+    id: int
+    company_name: Optional[str]
+    email: EmailStr
+    verified: bool
+    score: float
+    # HTML: the escaped text with matched words wrapped in <mark>
+    name_highlight: str
+    snippet: str
+
+class BusinessSearchPage(BaseModel):
+    items: List[BusinessSearchResult]
+    next_cursor: Optional[str] = None
+
 class OTPGenerateRequest(BaseModel):
     email: EmailStr = Field(..., description="Valid email address")
 
@@ -51,6 +77,7 @@ class OTPVerifyResponse(BaseModel):
     email: EmailStr
     valid: bool
     message: str
+    access_token: Optional[str] = None
 
 class UserCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=255, description="User name")
@@ -76,4 +103,24 @@ class UserCreate(BaseModel):
 class User(BaseModel):
     id: int
     name: str
-    email: EmailStr
\ No newline at end of file
+    email: EmailStr
+
+class CompanyUser(BaseModel):
+    id: int
+    name: Optional[str]
+    email: EmailStr
+    role: Optional[str]
+    created_at: datetime
+
+class CompanyUserPage(BaseModel):
+    items: List[CompanyUser]
+    next_cursor: Optional[str] = None
+
+class Principal(BaseModel):
+    # Authenticated caller, built from the session record or token claims (no database access).
+    # Businesses signed in by OTP have no users row, so their user_id is None.
+    user_id: Optional[int] = None
+    email: str
+    company_id: int
+    role: str
+    permissions_version: int
@@ -0,0 +1,286 @@
+from collections import OrderedDict
+from app.schemas import Principal
+import asyncio
+import hashlib
+import logging
+import redis.asyncio as redis
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Keyspace events that end a session (needs notify-keyspace-events with K, g, x and e)
+_ENDING_EVENTS = {"del", "expired", "evicted"}
+
+# Reads a session hash and, when allowed and less than ARGV[2] ms remain,
+# pushes its expiry back to ARGV[1] ms, all in one round trip.
+# Returns {} for a missing session, else {pttl, refreshed, field, value, ...}.
+READ_AND_REFRESH_SCRIPT = """
+local record = redis.call('HGETALL', KEYS[1])
+if #record == 0 then
+    return {}
+end
+local pttl = redis.call('PTTL', KEYS[1])
+local refreshed = 0
+if ARGV[3] == '1' and pttl >= 0 and pttl < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+    pttl = tonumber(ARGV[1])
+    refreshed = 1
+end
+local result = {pttl, refreshed}
+for i = 1, #record do
+    result[#result + 1] = record[i]
+end
+return result
+"""
+
+
+# Compact field names for session hashes and token claims; "uid" is left out
+# for business principals (Redis hashes cannot hold None)
+def principal_record(principal):
+    record = {
+        "email": principal.email,
+        "cid": principal.company_id,
+        "role": principal.role,
+        "pv": principal.permissions_version,
+    }
+    if principal.user_id is not None:
+        record["uid"] = principal.user_id
+    return record
+
+
+def principal_from_record(record):
+    return Principal(
+        user_id=int(record["uid"]) if record.get("uid") is not None else None,
+        email=record["email"],
+        company_id=int(record["cid"]),
+        role=record["role"],
+        permissions_version=int(record["pv"]),
+    )
+
+
+class SessionCache:
+    # Bounded LRU of session_id -> (Principal, expiry deadline); entries also expire after ttl_seconds
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_id):
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[session_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return value
+
+    def set(self, session_id, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[session_id] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, session_id):
+        if self._entries.pop(session_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class SessionStore:
+    def __init__(self, redis_client, ttl_seconds, cache, refresh_fraction, refresh_dedupe_seconds,
+                 prefix="session:", index_prefix="user_sessions:", channel="session:invalidate"):
+        self.redis = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.cache = cache
+        # Sliding expiry: refresh once less than this share of the TTL remains
+        self.refresh_threshold = ttl_seconds * refresh_fraction
+        self.refresh_dedupe_seconds = refresh_dedupe_seconds
+        self.prefix = prefix
+        # Per-user set of session IDs; must not share the session prefix (keyspace events)
+        self.index_prefix = index_prefix
+        self.channel = channel
+        self._listener = None
+        self._read_and_refresh = redis_client.register_script(READ_AND_REFRESH_SCRIPT)
+        # session_id -> monotonic time of this worker's last TTL refresh
+        self._refreshed = OrderedDict()
+        self.refreshes = 0
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def _index_key(self, email):
+        return f"{self.index_prefix}{email.lower()}"
+
+    async def create(self, principal):
+        # Written once at login as a Redis hash; reads never need Postgres
+        session_id = str(uuid.uuid4())
+        key = self._key(session_id)
+        index_key = self._index_key(principal.email)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(key, mapping=principal_record(principal))
+        pipe.expire(key, self.ttl_seconds)
+        # The index lives as long as the newest session; stale members are dropped lazily
+        pipe.sadd(index_key, session_id)
+        pipe.expire(index_key, self.ttl_seconds)
+        await pipe.execute()
+        return session_id
+
+    def _may_refresh(self, session_id, now):
+        last = self._refreshed.get(session_id)
+        return last is None or now - last >= self.refresh_dedupe_seconds
+
+    def _mark_refreshed(self, session_id, now):
+        self.refreshes += 1
+        self._refreshed[session_id] = now
+        self._refreshed.move_to_end(session_id)
+        while len(self._refreshed) > max(self.cache.max_entries, 1):
+            self._refreshed.popitem(last=False)
+
+    async def get(self, session_id):
+        # Returns (principal, refreshed); principal is None for a missing session
+        now = time.monotonic()
+        cached = self.cache.get(session_id)
+        if cached is not None and cached[1] > now:
+            principal, deadline = cached
+            if deadline - now >= self.refresh_threshold or not self._may_refresh(session_id, now):
+                return principal, False
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.expire(self._key(session_id), self.ttl_seconds)
+            pipe.expire(self._index_key(principal.email), self.ttl_seconds)
+            alive, _ = await pipe.execute()
+            if not alive:
+                self.cache.invalidate(session_id)
+                return None, False
+            self._mark_refreshed(session_id, now)
+            self.cache.set(session_id, (principal, now + self.ttl_seconds))
+            return principal, True
+        allow_refresh = "1" if self._may_refresh(session_id, now) else "0"
+        try:
+            result = await self._read_and_refresh(
+                keys=[self._key(session_id)],
+                args=[self.ttl_seconds * 1000, int(self.refresh_threshold * 1000), allow_refresh],
+            )
+        except redis.ResponseError:
+            # Plain-string session from before hashes were used; the user signs in again
+            return None, False
+        if not result:
+            return None, False
+        pttl, refreshed, fields = result[0], result[1], result[2:]
+        principal = principal_from_record(dict(zip(fields[::2], fields[1::2])))
+        if refreshed:
+            self._mark_refreshed(session_id, now)
+            # Rare (once per refresh window), so a second write here is cheap
+            await self.redis.expire(self._index_key(principal.email), self.ttl_seconds)
+        self.cache.set(session_id, (principal, now + max(pttl, 0) / 1000))
+        return principal, bool(refreshed)
+
+    async def delete(self, session_id, email):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(self._key(session_id))
+        pipe.srem(self._index_key(email), session_id)
+        # Explicit broadcast so invalidation works even without keyspace notifications
+        pipe.publish(self.channel, session_id)
+        await pipe.execute()
+        self.cache.invalidate(session_id)
+        self._refreshed.pop(session_id, None)
+
+    async def list_for_user(self, email):
+        # Returns [(session_id, ttl_seconds)] and drops index members whose session has expired
+        index_key = self._index_key(email)
+        session_ids = list(await self.redis.smembers(index_key))
+        if not session_ids:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.ttl(self._key(session_id))
+        ttls = await pipe.execute()
+        live = [(session_id, ttl) for session_id, ttl in zip(session_ids, ttls) if ttl != -2]
+        stale = [session_id for session_id, ttl in zip(session_ids, ttls) if ttl == -2]
+        if stale:
+            await self.redis.srem(index_key, *stale)
+        return live
+
+    async def delete_all_for_user(self, email):
+        # Revokes every session of a user in O(sessions of that user), without SCAN
+        index_key = self._index_key(email)
+        session_ids = list(await self.redis.smembers(index_key))
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.delete(self._key(session_id))
+            pipe.publish(self.channel, session_id)
+        pipe.delete(index_key)
+        results = await pipe.execute()
+        for session_id in session_ids:
+            self.cache.invalidate(session_id)
+            self._refreshed.pop(session_id, None)
+        # One DEL per session (every other result); index members whose session
+        # already expired delete nothing and are not counted
+        return sum(results[:-1:2])
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                await pubsub.psubscribe(f"__keyspace@*__:{self.prefix}*")
+                # Anything cached while we were not subscribed may be stale
+                self.cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.cache.invalidate(message["data"])
+                    elif message["type"] == "pmessage" and message["data"] in _ENDING_EVENTS:
+                        key = message["channel"].split("__:", 1)[1]
+                        self.cache.invalidate(key[len(self.prefix):])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Session invalidation listener failed: {str(e)}")
+                self.cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+def session_handle(session_id):
+    # Non-secret identifier for listing sessions; the session ID itself is a bearer credential
+    return hashlib.sha256(session_id.encode()).hexdigest()[:16]
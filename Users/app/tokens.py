@@ -0,0 +1,93 @@
+from jose import jwt, JWTError
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenDenylist:
+    # Revoked token IDs live in a Redis sorted set scored by token expiry, so
+    # the set only ever holds tokens that could still be presented. Each worker
+    # keeps a local copy refreshed every sync_seconds.
+    def __init__(self, redis_client, sync_seconds, key="token:denylist"):
+        self.redis = redis_client
+        self.sync_seconds = sync_seconds
+        self.key = key
+        self._revoked = set()
+        self._task = None
+
+    def __contains__(self, jti):
+        return jti in self._revoked
+
+    async def revoke(self, jti, expires_at):
+        await self.redis.zadd(self.key, {jti: expires_at})
+        self._revoked.add(jti)
+
+    async def sync(self):
+        now = int(time.time())
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zremrangebyscore(self.key, "-inf", now)
+        pipe.zrangebyscore(self.key, now, "+inf")
+        _, revoked = await pipe.execute()
+        self._revoked = set(revoked)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Token denylist sync failed: {str(e)}")
+            await asyncio.sleep(self.sync_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class TokenService:
+    def __init__(self, keys, ttl_seconds, denylist, algorithm="HS256"):
+        self.active_kid = keys[0][0] if keys else None
+        self._keys = dict(keys)
+        self.ttl_seconds = ttl_seconds
+        self.denylist = denylist
+        self.algorithm = algorithm
+
+    def issue(self, subject, claims=None):
+        now = int(time.time())
+        payload = dict(claims or {})
+        payload.update({"sub": subject, "iat": now, "exp": now + self.ttl_seconds, "jti": uuid.uuid4().hex})
+        token = jwt.encode(
+            payload, self._keys[self.active_kid], algorithm=self.algorithm, headers={"kid": self.active_kid}
+        )
+        return token, payload
+
+    def decode(self, token):
+        # Verified locally: signature, kid, expiry and the synced denylist
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid not in self._keys:
+                raise TokenError("Unknown signing key")
+            claims = jwt.decode(token, self._keys[kid], algorithms=[self.algorithm])
+        except JWTError as e:
+            raise TokenError(str(e))
+        if claims.get("jti") in self.denylist:
+            raise TokenError("Token has been revoked")
+        return claims
+
+    async def revoke(self, claims):
+        await self.denylist.revoke(claims["jti"], claims["exp"])
@@ -31,4 +31,54 @@ CREATE TABLE otps (
     CONSTRAINT unique_email UNIQUE (email)
 );
 
-ALTER TABLE otps ALTER COLUMN otp TYPE VARCHAR(255);
\ No newline at end of file
+ALTER TABLE otps ALTER COLUMN otp TYPE VARCHAR(255);
+-- Keyset listing (newest first). INCLUDE columns make the list pages index-only
+-- scans; the partial index serves the verified-businesses listing on its own.
+CREATE INDEX business_created_at_idx ON Business (created_at DESC, id DESC)
+    INCLUDE (company_name, email, verified);
+CREATE INDEX business_verified_created_at_idx ON Business (created_at DESC, id DESC)
+    INCLUDE (company_name, email) WHERE verified;
+-- Also backs the users.company_id foreign key
+CREATE INDEX users_company_created_at_idx ON Users (company_id, created_at DESC, id DESC)
+    INCLUDE (name, email, role);
+
+-- Business search: a stored, weighted tsvector for full-text queries, plus a
+-- trigram index on the name for partial and misspelled company names
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+ALTER TABLE Business ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(company_name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(operations, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(details, '')), 'C')
+) STORED;
+CREATE INDEX business_search_idx ON Business USING GIN (search_vector);
+CREATE INDEX business_name_trgm_idx ON Business USING GIN (company_name gin_trgm_ops);
+
+-- Lets the maintenance job purge expired OTPs in small index-ordered batches
+CREATE INDEX otps_expires_at_idx ON otps (expires_at);
+
+-- Activity/audit timeline, written in batches with COPY and partitioned by
+-- month so old months can be dropped whole. The scheduler keeps the next
+-- month's partition created ahead of time; DEFAULT catches anything outside.
+CREATE TABLE activity (
+    occurred_at TIMESTAMP NOT NULL,
+    event VARCHAR(50) NOT NULL,
+    actor_email VARCHAR(255),
+    company_id INTEGER,
+    ip VARCHAR(45),
+    details JSONB
+) PARTITION BY RANGE (occurred_at);
+CREATE TABLE activity_default PARTITION OF activity DEFAULT;
+CREATE INDEX activity_company_occurred_at_idx ON activity (company_id, occurred_at);
+DO $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', now() AT TIME ZONE 'UTC');
+BEGIN
+    FOR i IN 0..1 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF activity FOR VALUES FROM (%L) TO (%L)',
+            'activity_' || to_char(month_start + i * INTERVAL '1 month', 'YYYY_MM'),
+            month_start + i * INTERVAL '1 month',
+            month_start + (i + 1) * INTERVAL '1 month'
+        );
+    END LOOP;
+END $$;
@@ -0,0 +1,41 @@
+# Micro-benchmark: bcrypt vs keyed HMAC-SHA256 for OTP hashing and verification
+# Run with: python tests/bench_otp.py (from Users/, or any directory)
+import asyncio
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from passlib.context import CryptContext
+from app.otp import OtpHasher
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+otp_hasher = OtpHasher([("1", "bench-pepper")])
+email = "bench@example.com"
+otp = "123456"
+
+
+def bench(label, func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - start) / iterations
+    print(f"{label:<16} {per_call * 1e6:>12.1f} us/op")
+    return per_call
+
+
+bcrypt_hash = pwd_context.hash(otp)
+hmac_hash = otp_hasher.hash(email, otp)
+
+bcrypt_cost = bench("bcrypt hash", lambda: pwd_context.hash(otp), 5)
+bench("bcrypt verify", lambda: pwd_context.verify(otp, bcrypt_hash), 5)
+hmac_cost = bench("hmac hash", lambda: otp_hasher.hash(email, otp), 20000)
+
+
+async def verify_many(iterations):
+    for _ in range(iterations):
+        await otp_hasher.verify(email, otp, hmac_hash)
+
+start = time.perf_counter()
+asyncio.run(verify_many(20000))
+print(f"{'hmac verify':<16} {(time.perf_counter() - start) / 20000 * 1e6:>12.1f} us/op")
+print(f"hmac is ~{bcrypt_cost / hmac_cost:,.0f}x cheaper per OTP")
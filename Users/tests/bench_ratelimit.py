@@ -0,0 +1,84 @@
+# Benchmark: per-request limiter overhead as the route table grows.
+# fastapi-limiter walks request.app.routes on every call; app.ratelimit binds
+# route keys once at startup. Redis is replaced by an in-memory stand-in so
+# only the limiter's own work is measured.
+# Run with: python tests/bench_ratelimit.py (from Users/, or any directory)
+import asyncio
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# app.config refuses to load without a pepper; the benchmark never uses it
+os.environ.setdefault("OTP_PEPPERS", "1:bench")
+from fastapi import Depends, FastAPI
+from fastapi_limiter import FastAPILimiter
+from fastapi_limiter.depends import RateLimiter as FastAPILimiterRateLimiter
+from starlette.requests import Request
+from starlette.responses import Response
+from app.ratelimit import RateLimiter, RateLimiterBackend
+
+ITERATIONS = 20000
+
+
+class InMemoryRedis:
+    # fastapi-limiter's script returns 0 for "allowed"
+    async def evalsha(self, sha, numkeys, *args):
+        return 0
+
+    async def script_load(self, script):
+        return "sha"
+
+
+class InMemoryGCRA(InMemoryRedis):
+    # app.ratelimit's script returns {granted, remaining}; grant one token per
+    # call so every request takes the Redis path (worst case, no local lease)
+    async def evalsha(self, sha, numkeys, *args):
+        return [1, 0]
+
+
+def build_app(route_count, limiter_factory):
+    app = FastAPI()
+    for i in range(route_count):
+        @app.post(f"/route-{i}/", dependencies=[Depends(limiter_factory())])
+        async def endpoint():
+            return {}
+    return app
+
+
+def make_request(app, path):
+    route = next(r for r in app.routes if getattr(r, "path", None) == path)
+    scope = {
+        "type": "http", "app": app, "path": path, "method": "POST", "route": route,
+        "headers": [], "client": ("10.0.0.1", 1234), "query_string": b"",
+    }
+    return Request(scope), route.dependencies[0].dependency
+
+
+async def time_calls(call, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await call()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main():
+    await FastAPILimiter.init(InMemoryRedis())
+    print(f"{'routes':>8} {'fastapi-limiter':>18} {'app.ratelimit':>16}")
+    for route_count in (10, 100, 250, 500):
+        path = f"/route-{route_count - 1}/"
+
+        theirs_app = build_app(route_count, lambda: FastAPILimiterRateLimiter(times=5, seconds=60))
+        request, limiter = make_request(theirs_app, path)
+        response = Response()
+        theirs = await time_calls(lambda: limiter(request, response), ITERATIONS)
+
+        backend = RateLimiterBackend()
+        ours_app = build_app(route_count, lambda: RateLimiter(times=5, seconds=60, backend=backend))
+        await backend.init(InMemoryGCRA(), ours_app)
+        request, limiter = make_request(ours_app, path)
+        ours = await time_calls(lambda: limiter(request), ITERATIONS)
+
+        print(f"{route_count:>8} {theirs:>15.2f} us {ours:>13.2f} us")
+
+
+asyncio.run(main())
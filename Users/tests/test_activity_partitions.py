@@ -0,0 +1,84 @@
+# Tests for the activity partition maintenance job against a real database.
+# Run with: TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_activity_partitions.py
+# (from Users/). The database must be a scratch one loaded with init.sql; the
+# tests drop and recreate activity partitions in it.
+import asyncio
+import os
+import sys
+from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ.setdefault("OTP_PEPPERS", "1:test")
+    from app.activity import _month_start, maintain_activity_partitions
+    from app.database import pool_manager
+
+
+def _run(test):
+    async def run():
+        try:
+            async with pool_manager.acquire("background") as conn:
+                await test(conn)
+        finally:
+            await pool_manager.close()
+    asyncio.run(run())
+
+
+async def _partition_of(conn, occurred_at):
+    return await conn.fetchval(
+        "SELECT tableoid::regclass::text FROM activity WHERE occurred_at = $1", occurred_at
+    )
+
+
+def test_rows_stranded_in_default_move_to_the_new_month():
+    now = datetime.utcnow()
+    next_month = _month_start(now.year, now.month + 1)
+    later = _month_start(now.year, now.month + 2)
+    stranded = next_month.replace(day=15)
+    outside = later.replace(day=15)
+
+    async def test(conn):
+        await conn.execute(f"DROP TABLE IF EXISTS activity_{next_month:%Y_%m}, activity_{later:%Y_%m}")
+        await conn.execute("DELETE FROM activity_default")
+        await conn.executemany(
+            "INSERT INTO activity (occurred_at, event) VALUES ($1, 'seeded')", [(stranded,), (outside,)]
+        )
+        assert await _partition_of(conn, stranded) == "activity_default"
+
+        result = await maintain_activity_partitions(months_ahead=1)
+
+        assert result == {"created": 1, "dropped": 0, "failed": []}
+        assert await _partition_of(conn, stranded) == f"activity_{next_month:%Y_%m}"
+        # Rows for months the job does not cover stay in the default partition
+        assert await _partition_of(conn, outside) == "activity_default"
+        assert await conn.fetchval("SELECT count(*) FROM activity WHERE event = 'seeded'") == 2
+        await conn.execute("DELETE FROM activity WHERE event = 'seeded'")
+
+    _run(test)
+
+
+def test_a_failed_month_does_not_stop_the_others():
+    now = datetime.utcnow()
+    next_month = _month_start(now.year, now.month + 1)
+    later = _month_start(now.year, now.month + 2)
+    name = f"activity_{next_month:%Y_%m}"
+
+    async def test(conn):
+        await conn.execute(f"DROP TABLE IF EXISTS {name}, activity_{later:%Y_%m}")
+        # A plain table squatting on the partition's name makes its creation fail
+        await conn.execute(f"CREATE TABLE {name} (id INTEGER)")
+        try:
+            result = await maintain_activity_partitions(months_ahead=2)
+        finally:
+            await conn.execute(f"DROP TABLE {name}")
+
+        assert result["failed"] == [name]
+        assert result["created"] == 1
+        assert await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", f"activity_{later:%Y_%m}")
+        await maintain_activity_partitions(months_ahead=1)
+
+    _run(test)
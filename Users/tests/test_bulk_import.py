@@ -0,0 +1,127 @@
+# Tests for bulk import parsing and row validation (no database needed).
+# Run with: python -m pytest tests/test_bulk_import.py (from Users/)
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# app.config and app.database refuse to load without these; nothing connects
+os.environ.setdefault("OTP_PEPPERS", "1:test")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+import pytest
+from app.bulk_import import BulkImporter, ImportFormatError, _csv_records, _csv_rows, _ndjson_rows
+
+HEADER = b"name,email\n"
+CHUNK_SIZES = (1, 3, 7, 64, 1 << 16)
+
+
+async def _chunks(data, size, consumed=None):
+    for start in range(0, len(data), size):
+        if consumed is not None:
+            consumed.append(start)
+        yield data[start:start + size]
+
+
+def _collect(rows):
+    async def run():
+        return [row async for row in rows]
+    return asyncio.run(run())
+
+
+def csv_rows(data, size):
+    return _collect(_csv_rows(_chunks(data, size)))
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_rows_with_line_numbers(size):
+    rows = csv_rows(HEADER + b"Acme,a@x.com\nBeta,b@x.com\n", size)
+    assert rows == [(2, {"name": "Acme", "email": "a@x.com"}), (3, {"name": "Beta", "email": "b@x.com"})]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_multi_line_quoted_field(size):
+    data = HEADER + b'"Acme\nWidgets, ""Inc""",a@x.com\nBeta,b@x.com\n'
+    rows = csv_rows(data, size)
+    assert rows == [
+        (2, {"name": 'Acme\nWidgets, "Inc"', "email": "a@x.com"}),
+        (4, {"name": "Beta", "email": "b@x.com"}),
+    ]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_stray_quote_in_unquoted_field_is_literal(size):
+    data = HEADER + b'Beta 5" screen,b@x.com\nGamma,g@x.com\n'
+    rows = csv_rows(data, size)
+    assert rows == [
+        (2, {"name": 'Beta 5" screen', "email": "b@x.com"}),
+        (3, {"name": "Gamma", "email": "g@x.com"}),
+    ]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_blank_lines_crlf_bom_and_no_trailing_newline(size):
+    data = b"\xef\xbb\xbfname,email\r\n\r\nAcme,a@x.com\r\n\nBeta,b@x.com"
+    rows = csv_rows(data, size)
+    assert rows == [(3, {"name": "Acme", "email": "a@x.com"}), (5, {"name": "Beta", "email": "b@x.com"})]
+
+
+def test_column_count_mismatch_is_a_row_error():
+    rows = csv_rows(HEADER + b"Acme\nBeta,b@x.com\n", 1 << 16)
+    assert rows == [(2, "Expected 2 columns, got 1"), (3, {"name": "Beta", "email": "b@x.com"})]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_unterminated_quote_at_end_of_input(size):
+    with pytest.raises(ImportFormatError, match="line 3"):
+        csv_rows(HEADER + b'Acme,a@x.com\n"Beta,b@x.com\nGamma,g@x.com\n', size)
+
+
+def test_unterminated_quote_stops_at_the_record_size_limit():
+    # A quote that never closes must not pull the rest of the input into memory
+    data = HEADER + b'"Acme,a@x.com\n' + b"Beta,b@x.com\n" * 10000
+    consumed = []
+
+    async def run():
+        return [row async for row in _csv_records(_chunks(data, 1024, consumed), max_record=4096)]
+
+    with pytest.raises(ImportFormatError, match="Record starting on line 2"):
+        asyncio.run(run())
+    assert len(consumed) * 1024 < len(data) // 10
+
+
+def test_long_unbroken_line_is_rejected():
+    async def run():
+        return [row async for row in _ndjson_rows(_chunks(b"{" + b" " * 200000, 4096))]
+
+    with pytest.raises(ImportFormatError, match="Line 1 is longer"):
+        asyncio.run(run())
+
+
+def test_missing_header():
+    with pytest.raises(ImportFormatError, match="no header"):
+        csv_rows(b"\n\n", 1 << 16)
+
+
+def test_large_input_parses_every_row():
+    data = HEADER + b"".join(b"Name %d,u%d@x.com\n" % (i, i) for i in range(20000))
+    rows = csv_rows(data, 1 << 16)
+    assert len(rows) == 20000
+    assert rows[-1] == (20001, {"name": "Name 19999", "email": "u19999@x.com"})
+
+
+def test_ndjson_rows():
+    rows = _collect(_ndjson_rows(_chunks(b'{"email": "a@x.com"}\n\n[1]\nnot json\n', 5)))
+    assert rows[0] == (1, {"email": "a@x.com"})
+    assert rows[1] == (3, "Expected a JSON object")
+    assert rows[2][0] == 4 and rows[2][1].startswith("Invalid JSON")
+
+
+def test_user_rows_are_scoped_to_the_importing_company():
+    importer = BulkImporter("users", hashing_service=object(), company_id=7)
+    base = {"name": "U", "phone": "+1 555 1000", "password": "secret123", "role": "member"}
+    valid, rejected = importer._validate([
+        (2, {**base, "email": "own@x.com", "company_id": "7"}),
+        (3, {**base, "email": "default@x.com", "company_id": ""}),
+        (4, {**base, "email": "other@x.com", "company_id": "8"}),
+    ])
+    assert [(line, row.email, row.company_id) for line, row in valid] == [(2, "own@x.com", 7), (3, "default@x.com", 7)]
+    assert rejected == [(4, "company_id: can only import into your own company", "other@x.com")]
@@ -0,0 +1,121 @@
+# Tests for the leased GCRA rate limiter against fakeredis (runs the Lua script).
+# Run with: python -m pytest tests/test_ratelimit.py (from Users/)
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# app.config refuses to load without a pepper; nothing here uses it
+os.environ.setdefault("OTP_PEPPERS", "1:test")
+import pytest
+fakeredis = pytest.importorskip("fakeredis")
+from app.ratelimit import LIMIT_SCRIPT, RateLimiterBackend
+
+MINUTE_MS = 60000
+
+
+def _backend(redis, **settings):
+    backend = RateLimiterBackend(**{"lease_size": 10, "min_leased_limit": 100, **settings})
+    backend.redis = redis
+    return backend
+
+
+def _run(test):
+    async def run():
+        redis = fakeredis.FakeAsyncRedis()
+        sha = await redis.script_load(LIMIT_SCRIPT)
+        await test(redis, sha)
+        await redis.aclose()
+    asyncio.run(run())
+
+
+async def _admitted(backend, checks, attempts):
+    return sum([await backend.acquire(checks) == 0 for _ in range(attempts)])
+
+
+def test_lease_is_handed_out_and_spent_locally():
+    async def test(redis, sha):
+        backend = _backend(redis)
+        backend.sha = sha
+        checks = [("k", 1000, MINUTE_MS)]
+        # First call asks for one token to learn what is left, the second leases a full batch
+        assert await _admitted(backend, checks, 11) == 11
+        assert backend.redis_calls == 2
+        assert backend.local_decisions == 9
+
+    _run(test)
+
+
+def test_small_limits_never_lease():
+    async def test(redis, sha):
+        backend = _backend(redis)
+        backend.sha = sha
+        assert await _admitted(backend, [("k", 10, MINUTE_MS)], 15) == 10
+        # One call per admitted request plus the first denial; the rest are
+        # rejected locally until the next token is due
+        assert backend.redis_calls == 11
+        assert backend.local_decisions == 4
+
+    _run(test)
+
+
+def test_expired_lease_tokens_are_refunded():
+    async def test(redis, sha):
+        backend = _backend(redis, lease_seconds=0.05)
+        backend.sha = sha
+        checks = [("k", 100, MINUTE_MS)]
+        assert await _admitted(backend, checks, 2) == 2  # one token, then a lease of 10 (1 spent)
+        await asyncio.sleep(0.1)
+        assert await backend.acquire(checks) == 0
+        assert backend.refunded == 9
+        # The 9 unspent tokens went back before the new lease of 10 was taken,
+        # so only the 3 admitted requests and the live lease count (79 without the refund)
+        other = _backend(redis)
+        other.sha = sha
+        assert await _admitted(other, checks, 200) == 88
+
+    _run(test)
+
+
+def test_workers_never_over_admit():
+    async def test(redis, sha):
+        workers = [_backend(redis) for _ in range(4)]
+        for worker in workers:
+            worker.sha = sha
+        checks = [("k", 100, MINUTE_MS)]
+        admitted = 0
+        for _ in range(100):
+            for worker in workers:
+                admitted += await worker.acquire(checks) == 0
+        assert admitted <= 100
+        # Leases shrink near the limit, so little capacity is left stranded in workers
+        assert admitted >= 90
+
+    _run(test)
+
+
+def test_several_keys_are_checked_in_one_call_all_or_nothing():
+    async def test(redis, sha):
+        backend = _backend(redis)
+        backend.sha = sha
+        ip_checks = [("ip", 10, MINUTE_MS)]
+        both = [("ip", 10, MINUTE_MS), ("email", 2, MINUTE_MS)]
+        assert await _admitted(backend, both, 5) == 2
+        # One call per request for both keys, until the email key is blocked locally
+        assert backend.redis_calls == 3
+        # Requests the email limit denied took nothing from the IP limit
+        other = _backend(redis)
+        other.sha = sha
+        assert await _admitted(other, ip_checks, 20) == 8
+
+    _run(test)
+
+
+def test_script_is_reloaded_after_flush():
+    async def test(redis, sha):
+        backend = _backend(redis)
+        backend.sha = sha
+        await redis.script_flush()
+        assert await backend.acquire([("k", 10, MINUTE_MS)]) == 0
+        assert backend.script_reloads == 1
+
+    _run(test)